@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils import timezone
 import jdatetime
-from .models import User,FailedAttempt
+from .models import User,FailedAttempt,SMSOutbox
 # from core.models import Customer
 
 
@@ -50,4 +50,12 @@ class FaildAttemptAdmin(admin.ModelAdmin):
         # print(f'####local time:{local_time}')
         converted_date = jdatetime.datetime.fromgregorian(datetime=local_time) # don't convert time. the solution is above the line.
         # print(f'####converted_date:{converted_date}')
-        return converted_date.strftime("%Y-%m-%d %H:%M:%S")
\ No newline at end of file
+        return converted_date.strftime("%Y-%m-%d %H:%M:%S")
+
+
+@admin.register(SMSOutbox)
+class SMSOutboxAdmin(admin.ModelAdmin):
+    list_display = ['id','phone','template','status','attempts','next_attempt_at','sent_at']
+    list_filter = ['status']
+    search_fields = ['phone']
+    exclude = ['token']
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AuthAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'auth_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .jwt_keys import install_token_backend
+        install_token_backend()
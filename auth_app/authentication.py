@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from .revocation import USER_CLAIMS
+
+
+def user_cache_key(user_id):
+    return f'jwt-user:{user_id}'
+
+
+def invalidate_cached_user(*user_ids):
+    # also after commit: a request could cache the old row between the change and the commit
+    cache = caches[settings.JWT_USER_CACHE_ALIAS]
+    keys = [user_cache_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # JWTAuthentication that keeps the token's User for JWT_USER_CACHE_TTL seconds,
+    # dropped by the User save/delete signals (auth_app/signals.py). queryset.update()
+    # of users doesn't send signals, call invalidate_cached_user() after it
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        cache = caches[settings.JWT_USER_CACHE_ALIAS]
+        user = cache.get(user_cache_key(user_id))
+        if user is None:
+            # primary: a replica that lags behind a change would put the old row back in the cache
+            try:
+                user = self.user_model.objects.using('default').get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            cache.set(user_cache_key(user_id), user, settings.JWT_USER_CACHE_TTL)
+
+        # same checks as JWTAuthentication.get_user
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
+
+
+class ClaimsJWTAuthentication(CachedJWTAuthentication):
+    # trusts the phone/is_verified/is_staff claims of the token: request.user is a TokenUser
+    # (claims as attributes) and there is no user lookup. for services that only read these,
+    # views that change the user need the model (CachedJWTAuthentication).
+    # tokens minted before the claims were added take the cached lookup
+
+    def get_user(self, validated_token):
+        if all(claim in validated_token for claim in USER_CLAIMS):
+            return api_settings.TOKEN_USER_CLASS(validated_token)
+        return super().get_user(validated_token)
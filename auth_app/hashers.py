@@ -0,0 +1,143 @@
+import atexit
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, get_hasher, must_update_salt
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+
+class HashingOverloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Server is busy, try again later.'
+    default_code = 'hashing_overloaded'
+
+
+class HashingPool:
+    # runs password hashing on a fixed number of threads (pbkdf2 releases the GIL).
+    # at most `max_queue` calls wait for a thread, more than that are rejected with 503
+    # instead of piling up cpu work behind the ones already queued
+
+    def __init__(self, workers, max_queue):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(workers + max_queue)
+        self.lock = threading.Lock()
+        self.counters = {'calls': 0, 'rejected': 0, 'in_flight': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.counters['rejected'] += 1
+            raise HashingOverloaded()
+        try:
+            with self.lock:
+                self.counters['in_flight'] += 1
+            start = time.monotonic()
+            result = self.executor.submit(fn, *args).result()
+            elapsed = time.monotonic() - start
+            with self.lock:
+                self.counters['calls'] += 1
+                self.counters['total_seconds'] += elapsed
+                self.counters['max_seconds'] = max(self.counters['max_seconds'], elapsed)
+            logger.debug('password hash took %.1f ms', elapsed * 1000)
+            return result
+        finally:
+            with self.lock:
+                self.counters['in_flight'] -= 1
+            self.slots.release()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hashing_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashingPool(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_QUEUE)
+    return _pool
+
+
+def reset_hashing_pool():
+    # executor threads don't survive fork
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_hashing_pool)
+
+
+@atexit.register
+def log_hashing_stats():
+    # one line per worker process on exit, for sizing PASSWORD_HASH_WORKERS/PASSWORD_HASH_MAX_QUEUE
+    if _pool is not None:
+        stats = _pool.stats()
+        logger.info('password hashing: %d calls (avg %.1f ms, max %.1f ms), %d rejected', stats['calls'],
+                    stats['total_seconds'] / max(stats['calls'], 1) * 1000, stats['max_seconds'] * 1000,
+                    stats['rejected'])
+
+
+def calibrate_iterations(target_ms, sample_iterations=100_000):
+    # pbkdf2-sha256 iterations that take about `target_ms` on this machine (rounded down to 10k),
+    # never below django's own default, a fast machine must not weaken the hashes
+    elapsed = min(_time_pbkdf2(sample_iterations) for _ in range(3))
+    iterations = int(sample_iterations * target_ms / 1000 / elapsed) // 10_000 * 10_000
+    return max(iterations, settings.PASSWORD_HASH_MIN_ITERATIONS, PBKDF2PasswordHasher.iterations)
+
+
+def _time_pbkdf2(iterations):
+    start = time.perf_counter()
+    hashlib.pbkdf2_hmac('sha256', b'calibration', b'salt', iterations)
+    return time.perf_counter() - start
+
+
+class CalibratedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    # pbkdf2_sha256 (same format as django's default hasher) with:
+    # - iterations from PASSWORD_HASH_ITERATIONS, or calibrated once per process to PASSWORD_HASH_TARGET_MS
+    # - hashing on the bounded HashingPool
+    # - rehash on login when the stored iterations are more than PASSWORD_HASH_REHASH_TOLERANCE below
+    #   the current ones. only upward: stronger hashes (e.g. django's default) are kept, and the
+    #   tolerance keeps nodes with slightly different calibration from rehashing back and forth
+    _calibrated = None
+    _calibrate_lock = threading.Lock()
+
+    @property
+    def iterations(self):
+        if settings.PASSWORD_HASH_ITERATIONS:
+            return settings.PASSWORD_HASH_ITERATIONS
+        cls = type(self)
+        if cls._calibrated is None:
+            with cls._calibrate_lock:
+                if cls._calibrated is None:
+                    cls._calibrated = calibrate_iterations(settings.PASSWORD_HASH_TARGET_MS)
+                    logger.info('pbkdf2 calibrated to %d iterations', cls._calibrated)
+        return cls._calibrated
+
+    def encode(self, password, salt, iterations=None):
+        return get_hashing_pool().run(super().encode, password, salt, iterations)
+
+    def must_update(self, encoded):
+        decoded = self.decode(encoded)
+        update_salt = must_update_salt(decoded['salt'], self.salt_entropy)
+        too_weak = decoded['iterations'] < self.iterations * (1 - settings.PASSWORD_HASH_REHASH_TOLERANCE)
+        return too_weak or update_salt
+
+
+def warm_up():
+    # calibrate at worker boot (wsgi.py/asgi.py) instead of in the first login request
+    hasher = get_hasher()
+    if isinstance(hasher, CalibratedPBKDF2PasswordHasher):
+        hasher.iterations
@@ -0,0 +1,111 @@
+import base64
+import hashlib
+import json
+from functools import lru_cache
+import jwt
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError, TokenBackendExpiredToken
+from rest_framework_simplejwt.settings import api_settings
+
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+class SigningKey:
+    # private key loaded once, with its public key, algorithm, kid and public jwk precomputed
+
+    def __init__(self, pem):
+        from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+        from cryptography.hazmat.primitives.serialization import load_pem_private_key
+        self.private_key = load_pem_private_key(pem, password=None)
+        self.public_key = self.private_key.public_key()
+        if isinstance(self.private_key, ec.EllipticCurvePrivateKey) and self.private_key.curve.name == 'secp256r1':
+            self.algorithm = 'ES256'
+            numbers = self.public_key.public_numbers()
+            self.jwk = {'kty': 'EC', 'crv': 'P-256',
+                        'x': b64url(numbers.x.to_bytes(32, 'big')), 'y': b64url(numbers.y.to_bytes(32, 'big'))}
+        elif isinstance(self.private_key, ed25519.Ed25519PrivateKey):
+            self.algorithm = 'EdDSA'
+            self.jwk = {'kty': 'OKP', 'crv': 'Ed25519', 'x': b64url(self.public_key.public_bytes_raw())}
+        else:
+            raise ValueError('JWT signing keys must be P-256 (ES256) or Ed25519 (EdDSA) keys')
+        # RFC 7638 thumbprint: sha256 of the required members in lexicographic order
+        thumbprint = json.dumps(self.jwk, sort_keys=True, separators=(',', ':')).encode()
+        self.kid = b64url(hashlib.sha256(thumbprint).digest())
+        self.jwk = {**self.jwk, 'kid': self.kid, 'alg': self.algorithm, 'use': 'sig'}
+
+
+@lru_cache
+def get_signing_keys():
+    # JWT_PRIVATE_KEY_FILES: the first key signs, all of them verify
+    keys = []
+    for path in settings.JWT_PRIVATE_KEY_FILES:
+        with open(path, 'rb') as f:
+            keys.append(SigningKey(f.read()))
+    return keys
+
+
+@lru_cache
+def get_jwks():
+    # (body, etag) of the JWKS document
+    body = json.dumps({'keys': [key.jwk for key in get_signing_keys()]})
+    return body, hashlib.sha256(body.encode()).hexdigest()
+
+
+class KeyRingTokenBackend(TokenBackend):
+    # simplejwt backend that signs with the first of `keys` (kid in the header) and
+    # verifies with the key named by the token's kid
+
+    def __init__(self, keys, **kwargs):
+        super().__init__(keys[0].algorithm, **kwargs)
+        self.signing = keys[0]
+        self.keys = {key.kid: key for key in keys}
+
+    def encode(self, payload):
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload['aud'] = self.audience
+        if self.issuer is not None:
+            jwt_payload['iss'] = self.issuer
+        return jwt.encode(jwt_payload, self.signing.private_key, algorithm=self.signing.algorithm,
+                          headers={'kid': self.signing.kid}, json_encoder=self.json_encoder)
+
+    def decode(self, token, verify=True):
+        try:
+            key = self.keys.get(jwt.get_unverified_header(token).get('kid'))
+            if key is None:
+                raise TokenBackendError(_('Token is invalid'))
+            return jwt.decode(
+                token,
+                key.public_key,
+                algorithms=[key.algorithm],
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.get_leeway(),
+                options={
+                    'verify_aud': self.audience is not None,
+                    'verify_signature': verify,
+                },
+            )
+        except jwt.ExpiredSignatureError as ex:
+            raise TokenBackendExpiredToken(_('Token is expired')) from ex
+        except jwt.InvalidTokenError as ex:
+            raise TokenBackendError(_('Token is invalid')) from ex
+
+
+def install_token_backend():
+    # simplejwt has no backend setting, its tokens resolve rest_framework_simplejwt.state.token_backend
+    keys = get_signing_keys()
+    if not keys:
+        return  # SIMPLE_JWT ALGORITHM / SIGNING_KEY (HS256 with SECRET_KEY)
+    from rest_framework_simplejwt import state
+    state.token_backend = KeyRingTokenBackend(
+        keys,
+        audience=api_settings.AUDIENCE,
+        issuer=api_settings.ISSUER,
+        leeway=api_settings.LEEWAY,
+        json_encoder=api_settings.JSON_ENCODER,
+    )
@@ -0,0 +1,243 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from functools import lru_cache
+from itertools import chain
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import FailedAttempt, FailedAttemptBucket
+
+logger = logging.getLogger(__name__)
+
+
+
+class BaseAttemptLimiter:
+    # counts failed attempts per ip and per phone in the last ATTEMPTS_TIME_RANGE hours
+    # and blocks when one of them is more than FAILED_ATTEMPTS_LIMIT
+
+    def is_allowed(self, ip_address, phone=None, attempt_type='LOGIN'):
+        if phone and self.count('phone', phone, attempt_type) > settings.FAILED_ATTEMPTS_LIMIT:
+            return False
+        if self.count('ip', ip_address, attempt_type) > settings.FAILED_ATTEMPTS_LIMIT:
+            return False
+        return True
+
+    def count(self, kind, value, attempt_type):
+        raise NotImplementedError
+
+    def record(self, ip_address, phone=None, attempt_type='LOGIN'):
+        raise NotImplementedError
+
+    # async versions for the async views
+    async def ais_allowed(self, ip_address, phone=None, attempt_type='LOGIN'):
+        if phone and await self.acount('phone', phone, attempt_type) > settings.FAILED_ATTEMPTS_LIMIT:
+            return False
+        if await self.acount('ip', ip_address, attempt_type) > settings.FAILED_ATTEMPTS_LIMIT:
+            return False
+        return True
+
+    async def acount(self, kind, value, attempt_type):
+        return await sync_to_async(self.count)(kind, value, attempt_type)
+
+    async def arecord(self, ip_address, phone=None, attempt_type='LOGIN'):
+        await sync_to_async(self.record)(ip_address, phone, attempt_type)
+
+    @staticmethod
+    def audit(ip_address, phone=None, attempt_type='LOGIN'):
+        if settings.FAILED_ATTEMPTS_AUDIT:
+            FailedAttempt.objects.create(ip_address=ip_address, phone=phone, attempt_type=attempt_type)
+
+
+class DatabaseAttemptLimiter(BaseAttemptLimiter):
+    # one FailedAttempt row per attempt, COUNT(*) on every check
+
+    def get_queryset(self, kind, value, attempt_type):
+        one_hour_ago = timezone.now() - timedelta(hours=settings.ATTEMPTS_TIME_RANGE)
+        lookup = 'ip_address' if kind == 'ip' else 'phone'
+        return FailedAttempt.objects.filter(attempt_type=attempt_type,
+                                            created_at__gte=one_hour_ago,
+                                            **{lookup: value})
+
+    def count(self, kind, value, attempt_type):
+        return self.get_queryset(kind, value, attempt_type).count()
+
+    async def acount(self, kind, value, attempt_type):
+        return await self.get_queryset(kind, value, attempt_type).acount()
+
+    def record(self, ip_address, phone=None, attempt_type='LOGIN'):
+        FailedAttempt.objects.create(
+            ip_address=ip_address,
+            phone=phone,
+            attempt_type=attempt_type
+        )
+
+
+class BufferedAttemptLimiter(DatabaseAttemptLimiter):
+    # write-behind DatabaseAttemptLimiter: record() only appends to a per-process buffer, a
+    # background thread writes it with one bulk_create every FAILED_ATTEMPTS_FLUSH_INTERVAL
+    # seconds, when FAILED_ATTEMPTS_FLUSH_SIZE attempts are waiting, and at exit.
+    # checks add the unflushed attempts of this process to the db count. other processes
+    # see them after the flush. created_at is the flush time (auto_now_add), at most one
+    # interval late, so attempts leave the window a bit later, never earlier.
+    # while the db is down the buffer keeps the newest FAILED_ATTEMPTS_MAX_BUFFER attempts
+
+    def __init__(self):
+        self.reset()
+        atexit.register(self.flush)
+        # the thread doesn't survive fork and the child must not write the parent's buffer again
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = deque(maxlen=settings.FAILED_ATTEMPTS_MAX_BUFFER)  # (ip, phone, attempt_type, created_at)
+        self.flushing = []  # taken by the running flush, still counted until it is committed
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self):
+        # lazily (a forked worker starts its own thread), and again if the thread died
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self.run, name='failed-attempts-flush', daemon=True)
+                    self.thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(settings.FAILED_ATTEMPTS_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # the attempts are back in the buffer, the thread must keep running
+                logger.exception('failed attempts flush failed, retrying')
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                self.flushing = list(self.pending)
+                self.pending.clear()
+            if not self.flushing:
+                return
+            try:
+                FailedAttempt.objects.bulk_create(
+                    [FailedAttempt(ip_address=ip_address, phone=phone, attempt_type=attempt_type)
+                     for ip_address, phone, attempt_type, _ in self.flushing],
+                    batch_size=settings.FAILED_ATTEMPTS_FLUSH_SIZE,
+                )
+            except Exception:
+                # keep them for the next flush, the oldest are dropped when the buffer is full
+                with self.lock:
+                    self.pending = deque([*self.flushing, *self.pending], maxlen=settings.FAILED_ATTEMPTS_MAX_BUFFER)
+                    self.flushing = []
+                raise
+            with self.lock:
+                self.flushing = []
+
+    def pending_count(self, kind, value, attempt_type):
+        window_start = timezone.now() - timedelta(hours=settings.ATTEMPTS_TIME_RANGE)
+        index = 0 if kind == 'ip' else 1
+        with self.lock:
+            return sum(1 for attempt in chain(self.flushing, self.pending)
+                       if attempt[index] == value and attempt[2] == attempt_type and attempt[3] >= window_start)
+
+    def count(self, kind, value, attempt_type):
+        return super().count(kind, value, attempt_type) + self.pending_count(kind, value, attempt_type)
+
+    async def acount(self, kind, value, attempt_type):
+        return await super().acount(kind, value, attempt_type) + self.pending_count(kind, value, attempt_type)
+
+    def record(self, ip_address, phone=None, attempt_type='LOGIN'):
+        self.start()
+        with self.lock:
+            self.pending.append((ip_address, phone, attempt_type, timezone.now()))
+            full = len(self.pending) >= settings.FAILED_ATTEMPTS_FLUSH_SIZE
+        if full:
+            self.wakeup.set()
+
+    async def arecord(self, ip_address, phone=None, attempt_type='LOGIN'):
+        # no io, the flush thread writes
+        self.record(ip_address, phone, attempt_type)
+
+
+class CacheAttemptLimiter(BaseAttemptLimiter):
+    # sliding window split into FAILED_ATTEMPTS_BUCKETS fixed sub-buckets, one cache counter
+    # per (attempt_type, ip/phone, bucket). a check reads all buckets of the window with one
+    # get_many; the window is rounded out to whole buckets so it never counts less than the db
+    key_prefix = 'attempts'
+
+    def __init__(self):
+        self.cache = caches[settings.FAILED_ATTEMPTS_CACHE_ALIAS]
+        self.window = settings.ATTEMPTS_TIME_RANGE * 3600
+        self.bucket_size = self.window / settings.FAILED_ATTEMPTS_BUCKETS
+
+    def current_bucket(self):
+        return int(time.time() // self.bucket_size)
+
+    def make_key(self, kind, value, attempt_type, bucket):
+        return f'{self.key_prefix}:{attempt_type}:{kind}:{value}:{bucket}'
+
+    def window_keys(self, kind, value, attempt_type):
+        bucket = self.current_bucket()
+        return [self.make_key(kind, value, attempt_type, b)
+                for b in range(bucket - settings.FAILED_ATTEMPTS_BUCKETS, bucket + 1)]
+
+    def count(self, kind, value, attempt_type):
+        return sum(self.cache.get_many(self.window_keys(kind, value, attempt_type)).values())
+
+    async def acount(self, kind, value, attempt_type):
+        return sum((await self.cache.aget_many(self.window_keys(kind, value, attempt_type))).values())
+
+    def incr(self, key):
+        timeout = self.window + self.bucket_size
+        if self.cache.add(key, 1, timeout=timeout):
+            return
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # expired between add() and incr()
+            self.cache.add(key, 1, timeout=timeout)
+
+    def record(self, ip_address, phone=None, attempt_type='LOGIN'):
+        bucket = self.current_bucket()
+        self.incr(self.make_key('ip', ip_address, attempt_type, bucket))
+        if phone:
+            self.incr(self.make_key('phone', phone, attempt_type, bucket))
+        self.audit(ip_address, phone, attempt_type)
+
+
+class RollupAttemptLimiter(BaseAttemptLimiter):
+    # durable per-minute counters in FailedAttemptBucket (shared by all workers/nodes).
+    # a check sums at most one row per minute of the window instead of counting raw attempts
+
+    def count(self, kind, value, attempt_type):
+        window_start = timezone.now() - timedelta(hours=settings.ATTEMPTS_TIME_RANGE)
+        return FailedAttemptBucket.objects.filter(
+            attempt_type=attempt_type,
+            ip_or_phone=value,
+            minute_bucket__gte=window_start.replace(second=0, microsecond=0)
+        ).aggregate(total=Sum('count'))['total'] or 0
+
+    def record(self, ip_address, phone=None, attempt_type='LOGIN'):
+        keys = [ip_address, phone] if phone else [ip_address]
+        minute_bucket = timezone.now().replace(second=0, microsecond=0)
+        FailedAttemptBucket.increment(attempt_type, keys, minute_bucket)
+        self.audit(ip_address, phone, attempt_type)
+
+
+@lru_cache(maxsize=None)
+def get_attempt_limiter():
+    return import_string(settings.FAILED_ATTEMPTS_LIMITER)()
+
@@ -0,0 +1,96 @@
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from auth_app.models import SMSOutbox
+from auth_app.services import OTPService
+
+
+class Command(BaseCommand):
+    help = 'Send queued OTP sms from SMSOutbox with a thread pool, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.SMS_OUTBOX_WORKERS)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--poll-interval', type=float, default=0.5, help='seconds to wait when the outbox is empty')
+        parser.add_argument('--lease', type=int, default=60, help='seconds a claimed message is hidden from other dispatchers')
+        parser.add_argument('--once', action='store_true', help='drain the outbox once and exit')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'####### Dispatching sms with {options["workers"]} workers...')
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                messages = self.claim(options['batch_size'], options['lease'])
+                if messages:
+                    groups = self.group(messages)
+                    for group, errors in zip(groups, executor.map(self.send_group, groups)):
+                        for message, error in zip(group, errors):
+                            self.finish(message, error)
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['poll_interval'])
+
+    def claim(self, batch_size, lease):
+        # lock due messages (skip the ones another dispatcher holds) and push their
+        # next_attempt_at forward, so a crashed dispatcher's messages become due again
+        now = timezone.now()
+        with transaction.atomic():
+            messages = list(SMSOutbox.objects.select_for_update(skip_locked=True).filter(
+                status=SMSOutbox.STATUS_PENDING,
+                next_attempt_at__lte=now
+            ).order_by('next_attempt_at')[:batch_size])
+            SMSOutbox.objects.filter(pk__in=[m.pk for m in messages]).update(
+                next_attempt_at=now + timedelta(seconds=lease))
+        return messages
+
+    @staticmethod
+    def group(messages):
+        # bulk otp rows: one batch per template for the provider's array api. a phone queued
+        # twice goes to a second batch, results of a batch are keyed by phone.
+        # interactive otps stay single sends (verify/lookup template, in parallel on the pool)
+        singles = [[message] for message in messages if not message.bulk]
+        groups = defaultdict(list)
+        seen = Counter()
+        for message in messages:
+            if message.bulk:
+                groups[message.template, seen[message.template, message.phone]].append(message)
+                seen[message.template, message.phone] += 1
+        return singles + list(groups.values())
+
+    @staticmethod
+    def send_group(group):
+        # a lone message keeps the single send (verify/lookup template)
+        if len(group) == 1:
+            return [Command.send(group[0])]
+        errors = OTPService.send_sms_batch([(message.phone, message.token) for message in group], group[0].template)
+        return [errors[message.phone] for message in group]
+
+    @staticmethod
+    def send(message):
+        try:
+            OTPService.send_sms(message.phone, message.token, message.template)
+        except ValidationError as e:
+            return ' '.join(e.messages)
+        return None
+
+    def finish(self, message, error):
+        message.attempts += 1
+        if error is None:
+            message.status = SMSOutbox.STATUS_SENT
+            message.sent_at = timezone.now()
+            message.token = ''
+        elif message.attempts >= settings.SMS_OUTBOX_MAX_ATTEMPTS:
+            message.status = SMSOutbox.STATUS_FAILED
+            message.last_error = error
+            self.stdout.write(self.style.ERROR(f'sms {message.pk} to {message.phone} failed: {error}'))
+        else:
+            message.last_error = error
+            delay = settings.SMS_OUTBOX_RETRY_DELAY * 2 ** (message.attempts - 1)
+            message.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        message.save(update_fields=['attempts', 'status', 'sent_at', 'token', 'last_error', 'next_attempt_at'])
@@ -0,0 +1,176 @@
+import csv
+import json
+import multiprocessing
+import os
+import time
+from contextlib import suppress
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from auth_app.models import User
+from auth_app.serializers import PHONE_RE
+
+# input columns, only phone is required. no/empty password -> unusable password (login by otp only).
+# with --on-conflict update an existing user keeps the fields the record leaves out or empty
+INPUT_FIELDS = ['phone', 'password', 'first_name', 'last_name', 'email']
+COLUMNS = INPUT_FIELDS + ['is_verified', 'is_active', 'is_staff', 'is_superuser', 'date_joined']
+
+
+class Command(BaseCommand):
+    help = 'Import users from a large CSV/NDJSON file: streamed, passwords hashed in a process pool, COPY/bulk_create in batches, resumable'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--input-format', choices=['csv', 'ndjson'], help='default: from the file extension')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='password hashing processes')
+        parser.add_argument('--on-conflict', choices=['skip', 'update', 'error'], default='skip',
+                            help='phone that already exists: keep it, overwrite it, or abort')
+        parser.add_argument('--method', choices=['copy', 'bulk'], help='default: copy on postgresql, bulk elsewhere')
+        parser.add_argument('--checkpoint', help='default: <path>.checkpoint')
+        parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start from the top')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['input_format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        method = options['method'] or ('copy' if connection.vendor == 'postgresql' else 'bulk')
+        if method == 'copy' and connection.vendor != 'postgresql':
+            raise CommandError('COPY needs postgresql, use --method bulk')
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        done = 0 if options['restart'] else self.read_checkpoint(checkpoint)
+        load = self.load_copy if method == 'copy' else self.load_bulk
+
+        # hash once here before forking, so the workers inherit the calibrated hasher cost
+        make_password('warm-up')
+        stats = {'processed': 0, 'written': 0, 'invalid': 0}
+        start = time.monotonic()
+        with open(path, newline='', encoding='utf-8') as f, ProcessPoolExecutor(
+                max_workers=options['workers'], mp_context=multiprocessing.get_context('fork')) as executor:
+            records = islice(self.read(f, input_format), done, None)
+            if done:
+                self.stdout.write(f'resuming after record {done}')
+            while True:
+                batch = list(islice(records, options['batch_size']))
+                if not batch:
+                    break
+                groups = self.prepare(batch, done, executor, options['workers'], stats,
+                                      options['on_conflict'] == 'update')
+                try:
+                    with transaction.atomic():
+                        written = sum(load(rows, options['on_conflict'], fields) for fields, rows in groups.items())
+                except IntegrityError as e:
+                    raise CommandError(f'records {done + 1}-{done + len(batch)} not imported: {e}') from e
+                done += len(batch)
+                stats['processed'] += sum(len(rows) for rows in groups.values())
+                stats['written'] += written
+                self.write_checkpoint(checkpoint, done)
+                self.stdout.write(f'{done} records, {stats["processed"]} processed, {stats["written"]} written, '
+                                  f'{stats["invalid"]} invalid, '
+                                  f'{stats["processed"] / (time.monotonic() - start):.0f} users/s')
+
+        # no checkpoint when no batch was written (empty file)
+        with suppress(FileNotFoundError):
+            os.remove(checkpoint)
+        # written: inserted, or updated with --on-conflict update. skipped existing phones are not counted
+        self.stdout.write(self.style.SUCCESS(
+            f'####OK#### {stats["written"]} users written ({stats["processed"]} processed), '
+            f'{stats["invalid"]} invalid records skipped in {time.monotonic() - start:.1f}s'))
+
+    @staticmethod
+    def read(f, input_format):
+        if input_format == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            # parsed in prepare(), a malformed line is an invalid record like a bad phone
+            for line in f:
+                yield line.strip()
+
+    def prepare(self, batch, offset, executor, workers, stats, update):
+        # validate, drop duplicate phones inside the batch (the last one wins) and hash passwords.
+        # rows are grouped by the fields to overwrite on conflict (--on-conflict update): the
+        # input fields the record provides, so an omitted field keeps the existing value
+        records = {}
+        for number, record in enumerate(batch, offset + 1):
+            if isinstance(record, str):
+                try:
+                    record = json.loads(record) if record else {}
+                except ValueError as e:
+                    stats['invalid'] += 1
+                    self.stderr.write(f'record {number}: invalid json ({e})')
+                    continue
+            if not isinstance(record, dict):
+                stats['invalid'] += 1
+                self.stderr.write(f'record {number}: not a json object')
+                continue
+            phone = str(record.get('phone') or '').strip()
+            if not PHONE_RE.match(phone):
+                stats['invalid'] += 1
+                self.stderr.write(f'record {number}: invalid phone {phone!r}')
+                continue
+            records[phone] = record
+
+        passwords = [record.get('password') for record in records.values()]
+        to_hash = [password for password in passwords if password]
+        hashed = iter(executor.map(make_password, to_hash, chunksize=max(1, len(to_hash) // (4 * workers))))
+        hashes = [next(hashed) if password else make_password(None) for password in passwords]
+        now = timezone.now()
+        groups = {}
+        for (phone, record), password in zip(records.items(), hashes):
+            fields = tuple(field for field in INPUT_FIELDS[1:] if update and record.get(field))
+            groups.setdefault(fields, []).append(
+                (phone, password, record.get('first_name') or '', record.get('last_name') or '',
+                 record.get('email') or '', False, True, False, False, now))
+        return groups
+
+    @staticmethod
+    def load_copy(rows, on_conflict, fields):
+        # COPY into a temp table, then one INSERT ... SELECT with the conflict policy
+        table = User._meta.db_table
+        columns = ', '.join(COLUMNS)
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS import_users ON COMMIT DELETE ROWS '
+                           f'AS SELECT {columns} FROM {table} WITH NO DATA')
+            # one batch can load several groups in its transaction
+            cursor.execute('TRUNCATE import_users')
+            with cursor.copy(f'COPY import_users ({columns}) FROM STDIN') as copy:
+                for row in rows:
+                    copy.write_row(row)
+            if on_conflict == 'update' and fields:
+                conflict = 'ON CONFLICT (phone) DO UPDATE SET ' + ', '.join(
+                    f'{column} = EXCLUDED.{column}' for column in fields)
+            else:
+                conflict = '' if on_conflict == 'error' else 'ON CONFLICT (phone) DO NOTHING'
+            cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM import_users {conflict}')
+            return cursor.rowcount
+
+    @staticmethod
+    def load_bulk(rows, on_conflict, fields):
+        users = [User(**dict(zip(COLUMNS, row))) for row in rows]
+        if on_conflict == 'update' and fields:
+            User.objects.bulk_create(users, update_conflicts=True, unique_fields=['phone'],
+                                     update_fields=list(fields))
+            return len(users)
+        # bulk_create doesn't report the rows ignore_conflicts skipped
+        ignore = on_conflict != 'error'
+        existing = User.objects.filter(phone__in=[user.phone for user in users]).count() if ignore else 0
+        User.objects.bulk_create(users, ignore_conflicts=ignore)
+        return len(users) - existing
+
+    @staticmethod
+    def read_checkpoint(checkpoint):
+        try:
+            with open(checkpoint) as f:
+                return json.load(f)['records']
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def write_checkpoint(checkpoint, done):
+        # records of committed batches. written after the commit: a crash in between repeats
+        # one batch, which --on-conflict skip/update absorb
+        with open(f'{checkpoint}.tmp', 'w') as f:
+            json.dump({'records': done}, f)
+        os.replace(f'{checkpoint}.tmp', checkpoint)
@@ -0,0 +1,88 @@
+import re
+import time as clock
+from datetime import datetime, time, timedelta, timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction
+from auth_app.models import FailedAttempt
+
+
+class Command(BaseCommand):
+    help = 'Create upcoming daily partitions of FailedAttempt and drop the ones older than the retention window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days-ahead', type=int, default=7)
+        parser.add_argument('--retention-days', type=int, default=settings.FAILED_ATTEMPTS_RETENTION_DAYS)
+        parser.add_argument('--daemon', action='store_true', help='keep running and maintain every --interval seconds')
+        parser.add_argument('--interval', type=int, default=3600)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write('Partitioning is only supported on postgresql, nothing to do.')
+            return
+        while True:
+            self.maintain(options['days_ahead'], options['retention_days'])
+            if not options['daemon']:
+                break
+            # don't hold an idle connection between runs
+            connections.close_all()
+            clock.sleep(options['interval'])
+
+    def maintain(self, days_ahead, retention_days):
+        self.table = FailedAttempt._meta.db_table
+        partitions = self.get_partitions()
+        if partitions is None:
+            self.stdout.write(self.style.ERROR(f'{self.table} is not a partitioned table (run migrate first)'))
+            return
+
+        today = datetime.now(timezone.utc).date()
+        first_kept = today - timedelta(days=retention_days)
+        # first day that is not covered by an existing partition. missed days (the command
+        # didn't run for a while) are filled too, their rows are moved out of the default partition
+        uppers = [upper.date() for _, upper in partitions if upper]
+        day = max(uppers) if uppers else today
+        day = max(day, first_kept)
+        while day <= today + timedelta(days=days_ahead):
+            self.create_partition(day)
+            day += timedelta(days=1)
+
+        cutoff = datetime.combine(first_kept, time(), timezone.utc)
+        for name, upper in partitions:
+            if upper and upper <= cutoff:
+                # dropping a partition is O(1) compared to a DELETE of its rows
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DROP TABLE {connection.ops.quote_name(name)}')
+                self.stdout.write(f'dropped partition {name}')
+
+        self.stdout.write(self.style.SUCCESS('####OK#### FailedAttempt partitions are up to date'))
+
+    def get_partitions(self):
+        # [(partition name, upper bound or None for the default partition)]
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid '
+                           'WHERE c.relname = %s', [self.table])
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i '
+                           'JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent '
+                           'WHERE p.relname = %s', [self.table])
+            partitions = []
+            for name, bound in cursor.fetchall():
+                match = re.search(r"TO \('([^']+)'\)", bound)
+                partitions.append((name, datetime.fromisoformat(match.group(1)) if match else None))
+            return partitions
+
+    def create_partition(self, day):
+        name = f'{self.table}_p{day:%Y%m%d}'
+        lower = datetime.combine(day, time(), timezone.utc).isoformat()
+        upper = datetime.combine(day + timedelta(days=1), time(), timezone.utc).isoformat()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'CREATE TABLE {name} (LIKE {self.table} INCLUDING DEFAULTS)')
+            # rows of this day that already landed in the default partition have to move
+            # into the new partition, otherwise ATTACH fails
+            cursor.execute(f'WITH moved AS (DELETE FROM {self.table}_default '
+                           'WHERE created_at >= %s AND created_at < %s RETURNING *) '
+                           f'INSERT INTO {name} SELECT * FROM moved', [lower, upper])
+            cursor.execute(f"ALTER TABLE {self.table} ATTACH PARTITION {name} "
+                           f"FOR VALUES FROM ('{lower}') TO ('{upper}')")
+        self.stdout.write(f'created partition {name}')
@@ -0,0 +1,93 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.utils import timezone
+from auth_app.models import OTPCode, FailedAttempt, FailedAttemptBucket, SMSOutbox, RevokedToken
+
+
+class Command(BaseCommand):
+    help = 'Delete expired OTP codes, old failed attempts, delivered sms and expired revoked tokens in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.1, help='seconds between batches')
+        parser.add_argument('--daemon', action='store_true', help='keep running and purge every --interval seconds')
+        parser.add_argument('--interval', type=int, default=300)
+
+    def handle(self, *args, **options):
+        while True:
+            self.purge_all(options['batch_size'], options['sleep'])
+            if not options['daemon']:
+                break
+            # don't hold an idle connection between runs
+            connections.close_all()
+            time.sleep(options['interval'])
+
+    def purge_all(self, batch_size, sleep):
+        now = timezone.now()
+        querysets = {
+            # used codes expire a few minutes later as well, expires_at index only
+            'OTPCode': OTPCode.objects.filter(expires_at__lt=now),
+            'FailedAttempt': FailedAttempt.objects.filter(
+                created_at__lt=now - timedelta(days=settings.FAILED_ATTEMPTS_RETENTION_DAYS)),
+            'FailedAttemptBucket': FailedAttemptBucket.objects.filter(
+                minute_bucket__lt=now - timedelta(hours=settings.ATTEMPTS_TIME_RANGE, minutes=1)),
+            'SMSOutbox': SMSOutbox.objects.filter(
+                status__in=[SMSOutbox.STATUS_SENT, SMSOutbox.STATUS_FAILED],
+                next_attempt_at__lt=now - timedelta(days=1)),
+            # an expired token fails verification on its own
+            'RevokedToken': RevokedToken.objects.filter(expires_at__lt=now),
+        }
+        if self.is_partitioned(FailedAttempt):
+            # old partitions are dropped whole by partition_failed_attempts, only the rows that
+            # landed in the default partition (no partition for their day) are deleted here
+            queryset = querysets.pop('FailedAttempt')
+            start = time.monotonic()
+            deleted = self.purge_default_partition(queryset.model, now - timedelta(
+                days=settings.FAILED_ATTEMPTS_RETENTION_DAYS), batch_size, sleep)
+            self.stdout.write(f'FailedAttempt (default partition): {deleted} rows deleted '
+                              f'in {time.monotonic() - start:.2f}s')
+        for name, queryset in querysets.items():
+            start = time.monotonic()
+            deleted = self.purge(queryset, batch_size, sleep)
+            self.stdout.write(f'{name}: {deleted} rows deleted in {time.monotonic() - start:.2f}s')
+
+    @staticmethod
+    def is_partitioned(model):
+        if connection.vendor != 'postgresql':
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid '
+                           'WHERE c.relname = %s', [model._meta.db_table])
+            return cursor.fetchone() is not None
+
+    def purge(self, queryset, batch_size, sleep):
+        # bounded DELETE ... WHERE pk IN (batch) statements keep locks and wal bursts short
+        total = 0
+        while True:
+            pks = list(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            deleted, _ = queryset.model.objects.filter(pk__in=pks).delete()
+            total += deleted
+            if len(pks) < batch_size:
+                break
+            time.sleep(sleep)
+        return total
+
+    def purge_default_partition(self, model, cutoff, batch_size, sleep):
+        # same batching as purge(), on the default partition only so the dated ones aren't scanned
+        table = connection.ops.quote_name(f'{model._meta.db_table}_default')
+        total = 0
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {table} WHERE id IN '
+                               f'(SELECT id FROM {table} WHERE created_at < %s LIMIT %s)', [cutoff, batch_size])
+                deleted = cursor.rowcount
+            total += deleted
+            if deleted < batch_size:
+                break
+            time.sleep(sleep)
+        return total
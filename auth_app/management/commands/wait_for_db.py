@@ -13,10 +13,14 @@ class Command(BaseCommand):
 #        db_host = connections['default'].settings_dict['HOST']
 #        db_port = connections['default'].settings_dict['PORT']
         
+        db_conn = connections['default']
+        if getattr(db_conn, 'pool', None): # postgres with OPTIONS['pool']
+            self.wait_for_pool(db_conn)
+            return
+
         while True:
             try:                
                 # 2. بررسی اتصال واقعی به دیتابیس
-                db_conn = connections['default']
                 db_conn.cursor()
                 break
                 
@@ -25,3 +29,23 @@ class Command(BaseCommand):
                 time.sleep(1)
         
         self.stdout.write(self.style.SUCCESS('####OK#### Database is available!'))
+
+    def wait_for_pool(self, db_conn):
+        # wait until the pool has opened its min_size connections, not just one connection
+        from psycopg_pool import PoolTimeout
+        while True:
+            try:
+                db_conn.pool.open(wait=True, timeout=5)
+                db_conn.cursor()
+                break
+            except (OperationalError, PoolTimeout):
+                self.stdout.write('****NOK***** Database unavailable, waiting...')
+                # a pool that timed out while opening is closed, the next access creates a new one
+                db_conn.close_pool()
+                time.sleep(1)
+
+        stats = db_conn.pool.get_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"####OK#### Database is available! (pool {stats['pool_size']}/{stats['pool_max']} connections)"))
+        db_conn.close()
+        db_conn.close_pool()
@@ -0,0 +1,37 @@
+import time
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+from .routers import start_request, end_request
+
+PIN_COOKIE = 'db_pin'
+
+
+@sync_and_async_middleware
+def replica_pinning_middleware(get_response):
+    # routing state for ReplicaRouter, and the read-your-writes cookie after a write
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = start_request(request.COOKIES.get(PIN_COOKIE))
+            try:
+                response = await get_response(request)
+            finally:
+                state = end_request(token)
+            return pin(response, state)
+    else:
+        def middleware(request):
+            token = start_request(request.COOKIES.get(PIN_COOKIE))
+            try:
+                response = get_response(request)
+            finally:
+                state = end_request(token)
+            return pin(response, state)
+    return middleware
+
+
+def pin(response, state):
+    if state.wrote:
+        pinned_until = time.time() + settings.DB_PIN_SECONDS
+        response.set_cookie(PIN_COOKIE, f'{pinned_until:.3f}', max_age=settings.DB_PIN_SECONDS,
+                            httponly=True, samesite='Lax')
+    return response
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 10:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FailedAttemptBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempt_type', models.CharField(max_length=20)),
+                ('ip_or_phone', models.CharField(max_length=45)),
+                ('minute_bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('attempt_type', 'ip_or_phone', 'minute_bucket'), name='unique_failed_attempt_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2 on 2026-10-18 10:36
+
+from datetime import datetime, time, timedelta, timezone
+from django.db import migrations, models
+
+
+def partition_failedattempt(apps, schema_editor):
+    # turn auth_app_failedattempt into a table range partitioned by created_at (postgresql only).
+    # existing rows go to the "history" partition, daily partitions are created by
+    # the partition_failed_attempts command, rows outside any partition land in "default"
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = 'auth_app_failedattempt'
+    tomorrow = datetime.combine(datetime.now(timezone.utc).date() + timedelta(days=1), time(), timezone.utc)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s',
+                       [table, f'{table}_pkey'])
+        indexes = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+        cursor.execute(f'ALTER INDEX {table}_pkey RENAME TO {table}_old_pkey')
+        cursor.execute(f'CREATE TABLE {table} (LIKE {table}_old INCLUDING DEFAULTS INCLUDING IDENTITY) '
+                       'PARTITION BY RANGE (created_at)')
+        # primary key of a partitioned table must contain the partition key
+        cursor.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)')
+        cursor.execute(f"CREATE TABLE {table}_history PARTITION OF {table} "
+                       f"FOR VALUES FROM (MINVALUE) TO ('{tomorrow.isoformat()}')")
+        cursor.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {table} SELECT * FROM {table}_old')
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                       f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)")
+        cursor.execute(f'DROP TABLE {table}_old')
+        for indexdef in indexes:
+            cursor.execute(indexdef)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0002_failedattemptbucket'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='failedattempt',
+            index=models.Index(fields=['ip_address', 'attempt_type', 'created_at'], name='failedattempt_ip_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='failedattempt',
+            index=models.Index(fields=['phone', 'attempt_type', 'created_at'], name='failedattempt_phone_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='otpcode',
+            index=models.Index(fields=['phone', 'code'], name='otpcode_phone_code_idx'),
+        ),
+        migrations.RunPython(partition_failedattempt, migrations.RunPython.noop),
+    ]
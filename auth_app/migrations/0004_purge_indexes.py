@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0003_indexes_and_failedattempt_partitioning'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='failedattempt',
+            index=models.Index(fields=['created_at'], name='failedattempt_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='failedattemptbucket',
+            index=models.Index(fields=['minute_bucket'], name='failedattemptbucket_minute_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='otpcode',
+            index=models.Index(fields=['expires_at'], name='otpcode_expires_at_idx'),
+        ),
+    ]
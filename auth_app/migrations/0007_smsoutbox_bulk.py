@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 11:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0006_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='smsoutbox',
+            name='bulk',
+            field=models.BooleanField(default=False),
+        ),
+    ]
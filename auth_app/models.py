@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.contrib.auth.password_validation import validate_password as validate_pass 
-from django.db import models
+from django.db import models, connection, connections, router
+from django.db.models.functions import Now
 from django.utils import timezone
 from datetime import timedelta
 from django.core.validators import RegexValidator,MinLengthValidator
@@ -47,6 +48,24 @@ class User(AbstractUser):
     def __str__(self):
         return self.phone
 
+class OTPCodeManager(models.Manager):
+
+    def consume(self, phone, code):
+        # validate and mark used in one conditional UPDATE, so two concurrent
+        # requests can't both use the same code. returns the matched row or None
+        # raw() would route this to a read replica
+        using = router.db_for_write(self.model)
+        table = connections[using].ops.quote_name(self.model._meta.db_table)
+        rows = list(self.raw(
+            f'UPDATE {table} SET is_used = %s '
+            'WHERE phone = %s AND code = %s AND is_used = %s AND expires_at >= %s '
+            'RETURNING *',
+            [True, phone, code, False, timezone.now()],
+            using=using
+        ))
+        return rows[0] if rows else None
+
+
 class OTPCode(models.Model):
     phone = models.CharField(max_length=11,\
                              validators=[RegexValidator(regex='^09\d{9}$'\
@@ -56,6 +75,13 @@ class OTPCode(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
     is_used = models.BooleanField(default=False)
+    objects = OTPCodeManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['phone', 'code'], name='otpcode_phone_code_idx'),
+            models.Index(fields=['expires_at'], name='otpcode_expires_at_idx'),
+        ]
 
     # set 5min expire time
     def save(self, *args, **kwargs):
@@ -70,6 +96,88 @@ class FailedAttempt(models.Model):
     attempt_type = models.CharField(max_length=20)  # in ['LOGIN','OTP'] 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # on postgresql the table is range partitioned by created_at (see migration 0003)
+    class Meta:
+        indexes = [
+            models.Index(fields=['ip_address', 'attempt_type', 'created_at'], name='failedattempt_ip_idx'),
+            models.Index(fields=['phone', 'attempt_type', 'created_at'], name='failedattempt_phone_idx'),
+            models.Index(fields=['created_at'], name='failedattempt_created_at_idx'),
+        ]
+
+class FailedAttemptBucket(models.Model):
+    # per-minute rollup of failed attempts, one row per (type, ip or phone, minute)
+    attempt_type = models.CharField(max_length=20)
+    ip_or_phone = models.CharField(max_length=45)
+    minute_bucket = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['attempt_type', 'ip_or_phone', 'minute_bucket'],
+                                    name='unique_failed_attempt_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['minute_bucket'], name='failedattemptbucket_minute_idx'),
+        ]
+
+    @classmethod
+    def increment(cls, attempt_type, keys, minute_bucket):
+        # INSERT ... ON CONFLICT DO UPDATE count = count + 1 for all keys in one statement
+        table = connection.ops.quote_name(cls._meta.db_table)
+        bucket = connection.ops.adapt_datetimefield_value(minute_bucket)
+        values = ', '.join(['(%s, %s, %s, 1)'] * len(keys))
+        params = []
+        for key in keys:
+            params += [attempt_type, key, bucket]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (attempt_type, ip_or_phone, minute_bucket, count) '
+                f'VALUES {values} '
+                'ON CONFLICT (attempt_type, ip_or_phone, minute_bucket) '
+                f'DO UPDATE SET count = {table}.count + 1',
+                params
+            )
+
+class SMSOutbox(models.Model):
+    # OTP sms waiting to be sent by the dispatch_sms worker (written in the same transaction as the OTP)
+    STATUS_PENDING = 'PENDING'
+    STATUS_SENT = 'SENT'
+    STATUS_FAILED = 'FAILED'
+
+    phone = models.CharField(max_length=11)
+    template = models.CharField(max_length=50)  # kavenegar template, in ['auth-login','auth-register']
+    token = models.CharField(max_length=6, blank=True)  # cleared after the sms is sent
+    bulk = models.BooleanField(default=False)  # admin bulk otp: sent in batches through the provider's array api
+    status = models.CharField(max_length=10, default=STATUS_PENDING, choices=[
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ])
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='smsoutbox_status_next_idx'),
+        ]
+
+
+class RevokedToken(models.Model):
+    # jti of revoked (rotated) refresh tokens, workers keep a bloom filter of it, see auth_app/revocation.py
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField()
+    # database clock, the bloom filter sync reads new rows by it
+    created_at = models.DateTimeField(db_default=Now())
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='revokedtoken_created_at_idx'),
+            models.Index(fields=['expires_at'], name='revokedtoken_expires_at_idx'),
+        ]
+
 # class IPBlock(models.Model):
 #     ip_address = models.GenericIPAddressField()
 #     *block_type = models.CharField(max_length=10, choices=[
@@ -0,0 +1,201 @@
+import hashlib
+import hmac
+import secrets
+import time
+from datetime import timedelta
+from functools import lru_cache
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.encoding import force_bytes
+from django.utils.module_loading import import_string
+from .models import OTPCode
+
+
+
+class BaseOTPStore:
+    # an OTP store keeps at most one live code per phone
+
+    @staticmethod
+    def generate_code():
+        # code = str(random.randint(100000, 999999)) don't support code that start 0 like (042...6)
+        return ''.join(secrets.choice('0123456789') for _ in range(6))
+
+    def issue(self, phone, purpose):
+        code = self.generate_code()
+        self.save(phone, code)
+        return code
+
+    def issue_many(self, phones, purpose):
+        # {phone: code}, stores override it with one write for all phones
+        return {phone: self.issue(phone, purpose) for phone in phones}
+
+    def save(self, phone, code):
+        raise NotImplementedError
+
+    def consume(self, phone, code):
+        # check the code and mark it used atomically, True only for the first caller
+        raise NotImplementedError
+
+    def has_code(self, phone):
+        # whether the phone has a live (issued, unused, unexpired) code
+        raise NotImplementedError
+
+    # async versions for the async views, stores override them with native async calls
+    async def aissue(self, phone, purpose):
+        return await sync_to_async(self.issue)(phone, purpose)
+
+    async def aconsume(self, phone, code):
+        return await sync_to_async(self.consume)(phone, code)
+
+    async def ahas_code(self, phone):
+        return await sync_to_async(self.has_code)(phone)
+
+
+class DatabaseOTPStore(BaseOTPStore):
+    # durable store: every code is a row in OTPCode (usable as audit trail)
+
+    def save(self, phone, code):
+        # Delete previous OTPs
+        OTPCode.objects.filter(phone=phone).delete()
+        OTPCode.objects.create(
+            phone=phone,
+            code=code,
+            expires_at=timezone.now() + timedelta(minutes=settings.OTP_EXPIRE_MINUTES)
+        )
+
+    def issue_many(self, phones, purpose):
+        codes = {phone: self.generate_code() for phone in phones}
+        expires_at = timezone.now() + timedelta(minutes=settings.OTP_EXPIRE_MINUTES)
+        OTPCode.objects.filter(phone__in=codes).delete()
+        OTPCode.objects.bulk_create(
+            [OTPCode(phone=phone, code=code, expires_at=expires_at) for phone, code in codes.items()],
+            batch_size=1000,
+        )
+        return codes
+
+    def consume(self, phone, code):
+        return OTPCode.objects.consume(phone, code) is not None
+
+    def has_code(self, phone):
+        return OTPCode.objects.filter(phone=phone, is_used=False, expires_at__gte=timezone.now()).exists()
+
+
+class CacheOTPStore(BaseOTPStore):
+    # short-lived codes live in the cache and expire with the cache TTL (no db writes)
+    key_prefix = 'otp'
+
+    def __init__(self):
+        self.cache = caches[settings.OTP_CACHE_ALIAS]
+
+    def make_key(self, phone):
+        return f'{self.key_prefix}:{phone}'
+
+    def save(self, phone, code):
+        # set() replaces the previous code of this phone
+        self.cache.set(self.make_key(phone), code, timeout=settings.OTP_EXPIRE_MINUTES * 60)
+
+    def issue_many(self, phones, purpose):
+        codes = {phone: self.generate_code() for phone in phones}
+        self.cache.set_many({self.make_key(phone): code for phone, code in codes.items()},
+                            timeout=settings.OTP_EXPIRE_MINUTES * 60)
+        return codes
+
+    def consume(self, phone, code):
+        key = self.make_key(phone)
+        stored = self.cache.get(key)
+        if stored is None or not constant_time_compare(stored, code):
+            return False
+        # delete() reports whether the key still existed, so only one caller can use the code
+        return self.cache.delete(key)
+
+    def has_code(self, phone):
+        return self.cache.has_key(self.make_key(phone))
+
+    async def ahas_code(self, phone):
+        return await self.cache.ahas_key(self.make_key(phone))
+
+    async def aissue(self, phone, purpose):
+        code = self.generate_code()
+        await self.cache.aset(self.make_key(phone), code, timeout=settings.OTP_EXPIRE_MINUTES * 60)
+        return code
+
+    async def aconsume(self, phone, code):
+        key = self.make_key(phone)
+        stored = await self.cache.aget(key)
+        if stored is None or not constant_time_compare(stored, code):
+            return False
+        return await self.cache.adelete(key)
+
+
+class HMACOTPStore(BaseOTPStore):
+    # HOTP/TOTP style codes derived from (secret, phone, purpose, time step, counter).
+    # issue only stores a small (purpose, step, counter) marker per phone, verification recomputes
+    # the one code of the last issue: a single live code per phone (as with the other stores) and
+    # re-issuing replaces it. the counter is bumped on every successful use so the next code
+    # differs, and a replay guard key (cache.add) keeps each code single use
+    key_prefix = 'otp-hmac'
+
+    def __init__(self):
+        self.cache = caches[settings.OTP_CACHE_ALIAS]
+        self.secret = force_bytes(settings.OTP_HMAC_SECRET)
+        self.window = settings.OTP_EXPIRE_MINUTES * 60
+
+    def current_step(self):
+        return int(time.time()) // settings.OTP_TIME_STEP
+
+    def marker_key(self, phone):
+        return f'{self.key_prefix}:issued:{phone}'
+
+    def get_counter(self, phone):
+        return self.cache.get(f'{self.key_prefix}:counter:{phone}', 0)
+
+    def derive_code(self, phone, purpose, step, counter):
+        msg = f'{phone}:{purpose}:{step}:{counter}'.encode()
+        digest = hmac.new(self.secret, msg, hashlib.sha256).digest()
+        # dynamic truncation (RFC 4226)
+        offset = digest[-1] & 0x0f
+        value = int.from_bytes(digest[offset:offset + 4], 'big') & 0x7fffffff
+        return f'{value % 1000000:06d}'
+
+    def issue(self, phone, purpose):
+        step = self.current_step()
+        counter = self.get_counter(phone)
+        self.cache.set(self.marker_key(phone), (purpose, step, counter), timeout=self.window)
+        return self.derive_code(phone, purpose, step, counter)
+
+    def issue_many(self, phones, purpose):
+        step = self.current_step()
+        counters = self.cache.get_many([f'{self.key_prefix}:counter:{phone}' for phone in phones])
+        counters = {phone: counters.get(f'{self.key_prefix}:counter:{phone}', 0) for phone in phones}
+        self.cache.set_many({self.marker_key(phone): (purpose, step, counters[phone]) for phone in phones},
+                            timeout=self.window)
+        return {phone: self.derive_code(phone, purpose, step, counters[phone]) for phone in phones}
+
+    def consume(self, phone, code):
+        # the marker expires with the code (OTP_EXPIRE_MINUTES). the counter is the one the code
+        # was derived with, the counter key may have expired since the issue
+        marker = self.cache.get(self.marker_key(phone))
+        if marker is None:
+            return False
+        purpose, step, counter = marker
+        if not constant_time_compare(self.derive_code(phone, purpose, step, counter), code):
+            return False
+        # add() is atomic, only the first request gets the code
+        if not self.cache.add(f'{self.key_prefix}:used:{phone}:{counter}', True,
+                              timeout=self.window + settings.OTP_TIME_STEP):
+            return False
+        self.cache.set(f'{self.key_prefix}:counter:{phone}', counter + 1,
+                       timeout=self.window + settings.OTP_TIME_STEP)
+        self.cache.delete(self.marker_key(phone))
+        return True
+
+    def has_code(self, phone):
+        return self.cache.has_key(self.marker_key(phone))
+
+
+@lru_cache(maxsize=None)
+def get_otp_store():
+    return import_string(settings.OTP_STORE)()
@@ -1,12 +1,45 @@
-from rest_framework.pagination import PageNumberPagination
+from django.db import connections
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 
 class CustomPagination(PageNumberPagination):
-    def get_page_size(self, request):
-        return request.query_params.get('page_size',10)
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
     
 
     def get_paginated_response(self, data):
         response = super().get_paginated_response(data)
-        response.data['page_size'] = self.request.query_params.get('page_size',10)
+        response.data['page_size'] = self.get_page_size(self.request)
         return response
-   
\ No newline at end of file
+
+
+class UserCursorPagination(CursorPagination):
+    # keyset pagination on the primary key (no COUNT, no OFFSET scan): ?pagination=cursor
+    # ?approximate_total=true adds the planner's row estimate of the table (postgres)
+    ordering = '-id'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.queryset = queryset
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['page_size'] = self.page_size
+        if self.request.query_params.get('approximate_total') in ('1', 'true'):
+            response.data['approximate_total'] = approximate_count(self.queryset)
+        return response
+
+
+def approximate_count(queryset):
+    # pg_class.reltuples (updated by vacuum/analyze) instead of COUNT(*), None if unknown
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                       [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    return row[0] if row and row[0] >= 0 else None
@@ -0,0 +1,175 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+from .models import RevokedToken
+
+USER_CLAIMS = ('phone', 'is_verified', 'is_staff')
+
+
+class BloomFilter:
+    # no false negatives, `error_rate` false positives at `capacity` items
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+        # double hashing over one 128 bit digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+class RevocationList:
+    # per-process bloom filter in front of RevokedToken: a jti that is not in the filter is
+    # not revoked (no query), a hit is confirmed in the table.
+    # new rows are pulled every TOKEN_REVOCATION_SYNC_INTERVAL seconds (the delay for revocations
+    # made by other processes), the filter is rebuilt every TOKEN_REVOCATION_REBUILD_INTERVAL
+    # seconds to drop expired jtis, or earlier when it grew over its capacity
+
+    def __init__(self):
+        self.filter = None
+        self.watermark = None  # newest created_at seen
+        self.synced_at = 0
+        self.rebuilt_at = 0
+        self.lock = threading.Lock()
+
+    def is_revoked(self, jti):
+        self.sync()
+        if jti not in self.filter:
+            return False
+        # primary: a replica may not have the row yet
+        return RevokedToken.objects.using('default').filter(jti=jti).exists()
+
+    def revoke(self, jti, expires_at):
+        # False if it was revoked already (e.g. by a concurrent refresh of the same token)
+        try:
+            with transaction.atomic(using='default'):
+                RevokedToken.objects.using('default').create(jti=jti, expires_at=expires_at)
+        except IntegrityError:
+            return False
+        self.sync()
+        # every filter mutation happens under the lock: add() is a read-modify-write of shared
+        # bytes, and a rebuild swapping the filter in between would drop the jti
+        with self.lock:
+            self.filter.add(jti)
+        return True
+
+    def sync(self):
+        now = time.monotonic()
+        if now - self.synced_at < settings.TOKEN_REVOCATION_SYNC_INTERVAL:
+            return
+        # one thread syncs, the others keep using the current filter (unless there is none yet)
+        if not self.lock.acquire(blocking=self.filter is None):
+            return
+        try:
+            if now - self.synced_at < settings.TOKEN_REVOCATION_SYNC_INTERVAL:
+                return
+            full = (self.filter is None or self.filter.count > self.filter.capacity
+                    or now - self.rebuilt_at >= settings.TOKEN_REVOCATION_REBUILD_INTERVAL)
+            if full:
+                self.rebuild()
+                self.rebuilt_at = now
+            else:
+                self.pull()
+            self.synced_at = now
+        finally:
+            self.lock.release()
+
+    def rebuild(self):
+        # rebuild() and pull() are called by sync() with self.lock held
+        queryset = RevokedToken.objects.using('default').filter(expires_at__gt=timezone.now())
+        watermark = queryset.aggregate(Max('created_at'))['created_at__max']
+        capacity = max(settings.TOKEN_REVOCATION_BLOOM_CAPACITY, 2 * queryset.count())
+        bloom = BloomFilter(capacity, settings.TOKEN_REVOCATION_BLOOM_ERROR_RATE)
+        for jti in queryset.values_list('jti', flat=True).iterator(chunk_size=5000):
+            bloom.add(jti)
+        self.filter, self.watermark = bloom, watermark
+
+    def pull(self):
+        queryset = RevokedToken.objects.using('default').all()
+        if self.watermark is not None:
+            # overlap, rows of transactions that committed late have an older created_at
+            queryset = queryset.filter(
+                created_at__gte=self.watermark - timedelta(seconds=settings.TOKEN_REVOCATION_SYNC_OVERLAP))
+        for jti, created_at in queryset.values_list('jti', 'created_at').iterator(chunk_size=5000):
+            self.filter.add(jti)
+            self.watermark = max(self.watermark or created_at, created_at)
+
+
+_revocation_list = None
+_revocation_lock = threading.Lock()
+
+
+def get_revocation_list():
+    global _revocation_list
+    if _revocation_list is None:
+        with _revocation_lock:
+            if _revocation_list is None:
+                _revocation_list = RevocationList()
+    return _revocation_list
+
+
+def reset_revocation_list():
+    global _revocation_list, _revocation_lock
+    _revocation_list = None
+    _revocation_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_revocation_list)
+
+
+class RevocableRefreshToken(RefreshToken):
+    # refresh token checked against RevokedToken, blacklist() (called by the refresh
+    # serializer on rotation) revokes it. used instead of simplejwt's token_blacklist app
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token.set_user_claims(user)
+        return token
+
+    def set_user_claims(self, user):
+        # copied into the access tokens, other services can trust them without a user lookup
+        # (ClaimsJWTAuthentication). set at login and again from the user on every refresh
+        for claim in USER_CLAIMS:
+            self[claim] = getattr(user, claim)
+
+    def verify(self, *args, **kwargs):
+        super().verify(*args, **kwargs)
+        if get_revocation_list().is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_('Token is revoked'))
+
+    def blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        if not get_revocation_list().revoke(jti, datetime_from_epoch(self.payload['exp'])):
+            # lost the race against another refresh with this token
+            raise TokenError(_('Token is revoked'))
+
+    def outstand(self):
+        # no outstanding-token list here (simplejwt's version needs the token_blacklist app)
+        return None
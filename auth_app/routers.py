@@ -0,0 +1,57 @@
+import random
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+
+# per-request routing state, set by ReplicaPinningMiddleware. None outside requests
+# (management commands, workers): everything goes to the primary there
+_request_state = ContextVar('db_request_state', default=None)
+
+
+class RequestState:
+    def __init__(self, pinned_until=0):
+        self.pinned_until = pinned_until
+        self.wrote = False
+
+    def pinned(self):
+        return self.wrote or self.pinned_until > time.time()
+
+
+def start_request(pin_cookie=None):
+    try:
+        pinned_until = float(pin_cookie or 0)
+    except ValueError:
+        pinned_until = 0
+    return _request_state.set(RequestState(pinned_until))
+
+
+def end_request(token):
+    state = _request_state.get()
+    _request_state.reset(token)
+    return state
+
+
+class ReplicaRouter:
+    # reads of a request go to a random replica, writes to the primary ('default').
+    # read-your-writes: after a write the rest of the request and, through the pin
+    # cookie, the next DB_PIN_SECONDS of the client's requests read from the primary
+
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if state is None or state.pinned() or connections['default'].in_atomic_block:
+            return 'default'
+        return random.choice(settings.DB_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -1,7 +1,16 @@
 import re
 from rest_framework import serializers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer, TokenVerifySerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import UntypedToken
+from django.conf import settings
 from django.contrib.auth.password_validation import validate_password as validate_pass 
 from .models import User
+from .revocation import RevocableRefreshToken, get_revocation_list
+
+
+PHONE_RE = re.compile(r'^09\d{9}$')
 
 
 class PhoneNumberSerializer(serializers.Serializer):
@@ -9,7 +18,7 @@ class PhoneNumberSerializer(serializers.Serializer):
 
     def validate_phone(self, value):
         # Simple phone number validation
-        if not re.match(r'^09\d{9}$', value):
+        if not PHONE_RE.match(value):
             raise serializers.ValidationError("Invalid phone number format")
         return value
 
@@ -33,6 +42,17 @@ class RegisterSerializer(PhoneNumberSerializer):
 class VerifyOTPSerializer(PhoneNumberSerializer):
     code = serializers.CharField(min_length=6, max_length=6)
 
+class BulkOTPSerializer(serializers.Serializer):
+    phones = serializers.ListField(child=serializers.CharField(max_length=11), allow_empty=False,
+                                   max_length=settings.BULK_OTP_MAX_PHONES)
+    order = serializers.ChoiceField(choices=settings.OTP_PURPOSES, default='auth-login')
+
+    def validate_phones(self, value):
+        invalid = [phone for phone in value if not PHONE_RE.match(phone)]
+        if invalid:
+            raise serializers.ValidationError(f"Invalid phone number format: {', '.join(invalid[:10])}")
+        return list(dict.fromkeys(value))
+
 # class ResendOTPSerializer(PhoneNumberSerializer):
 #     pass
 
@@ -80,4 +100,40 @@ class ChangePasswordSerializer(serializers.Serializer):
         password = self.validated_data['new_password']
         user.set_password(password)
         user.save()
-        return user
\ No newline at end of file
+        return user
+
+
+# jwt refresh/verify with the RevokedToken list (SIMPLE_JWT TOKEN_REFRESH_SERIALIZER/TOKEN_VERIFY_SERIALIZER)
+class RevocationTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = RevocableRefreshToken
+
+    def validate(self, attrs):
+        # simplejwt's validate, plus the USER_CLAIMS rewritten from the current user so a
+        # demoted or unverified user doesn't keep stale claims across refreshes
+        refresh = self.token_class(attrs['refresh'])
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        # primary: a replica may still have the row from before the change
+        user = User.objects.using('default').filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        refresh.set_user_claims(user)
+
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+            data['refresh'] = str(refresh)
+        return data
+
+
+class RevocationTokenVerifySerializer(TokenVerifySerializer):
+
+    def validate(self, attrs):
+        token = UntypedToken(attrs['token'])
+        if get_revocation_list().is_revoked(token.get(api_settings.JTI_CLAIM, '')):
+            raise serializers.ValidationError('Token is revoked')
+        return {}
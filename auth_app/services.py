@@ -1,104 +1,227 @@
-import random
-from datetime import timedelta
-from django.utils import timezone
+import secrets
+from functools import lru_cache
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.contrib.auth.hashers import make_password, verify_password
+from django.core.cache import caches
 from django.core.exceptions import ValidationError
-from kavenegar import *
-from .models import OTPCode, FailedAttempt
+from django.db import transaction
+from .authentication import invalidate_cached_user
+from .limiters import get_attempt_limiter
+from .models import SMSOutbox, User
+from .otp_stores import get_otp_store
+from .revocation import RevocableRefreshToken
+from .sms import get_sms_gateway, SMSError
 
 
+@lru_cache
+def get_dummy_password_hash():
+    # checked against for unknown phones, so they cost one hash like a real user
+    return make_password(secrets.token_urlsafe())
+
 
 class OTPService:
+    @staticmethod
+    def authenticate(phone, password):
+        # single User lookup for login: returns (user or None, whether the phone is registered)
+        user = User.objects.filter(phone=phone).first()
+        is_correct, must_update = OTPService.verify_password(user, password)
+        if must_update:
+            user.set_password(password)
+            user.save(update_fields=['password'])
+        return (user if is_correct else None), user is not None
+
+    @staticmethod
+    def verify_password(user, password):
+        # (is_correct, must_update) without touching the database, same rules as ModelBackend
+        if user is None:
+            verify_password(password, get_dummy_password_hash())
+            return False, False
+        is_correct, must_update = verify_password(password, user.password)
+        is_correct = is_correct and user.is_active
+        return is_correct, is_correct and must_update
+
+    @staticmethod
+    def otp_flight_key(phone):
+        return f'otp-flight:{phone}'
+
     @staticmethod
     def generate_otp(phone, order):
-        # Delete previous OTPs
-        OTPCode.objects.filter(phone=phone).delete()
+        # single flight per phone: only the first request of OTP_RESEND_COOLDOWN issues and sends
+        # a code, the others return None and the user gets the code of the first one.
+        # the flight key is 'issuing' until the code is out, then 'issued' (dropped when the code is used)
+        cache = caches[settings.OTP_CACHE_ALIAS]
+        key = OTPService.otp_flight_key(phone)
+        if settings.OTP_RESEND_COOLDOWN and not cache.add(key, 'issuing', timeout=settings.OTP_RESEND_COOLDOWN):
+            state = cache.get(key)
+            if state == 'issuing' or (state == 'issued' and get_otp_store().has_code(phone)):
+                return None
+            # the code of the flight is gone (replaced, expired): start a new one. delete + add so
+            # only one of the requests that saw the stale flight takes it over
+            cache.delete(key)
+            if not cache.add(key, 'issuing', timeout=settings.OTP_RESEND_COOLDOWN):
+                return None
+        try:
+            code = OTPService.issue_otp(phone, order)
+        except Exception:
+            # nothing was sent, let the retry through
+            cache.delete(key)
+            raise
+        if settings.OTP_RESEND_COOLDOWN:
+            cache.set(key, 'issued', timeout=settings.OTP_RESEND_COOLDOWN)
+        return code
+
+    @staticmethod
+    def issue_otp(phone, order):
+        if settings.SMS_OUTBOX:
+            # the sms is queued in the same transaction and sent by the dispatch_sms worker
+            with transaction.atomic():
+                code = get_otp_store().issue(phone, order)
+                SMSOutbox.objects.create(phone=phone, template=order, token=code)
+            return code
 
-        # Generate new OTP
-        # code = str(random.randint(100000, 999999)) don't support code that start 0 like (042...6)
-        code = ''.join(random.choices('0123456789', k=6))
-        expires_at = timezone.now() + timedelta(minutes=settings.OTP_EXPIRE_MINUTES)
+        # Generate and store new OTP (previous code of this phone is replaced)
+        code = get_otp_store().issue(phone, order)
         # print(f'###############code:{code}#############')
         
-        otp = OTPCode.objects.create(
-            phone=phone,
-            code=code,
-            expires_at=expires_at
-        )
-        
-        # TODO: Integrate with SMS service (transaction.attomic)
         # send OTP via sms
         OTPService.send_sms(phone, code, order)
         
         return code
     
 
+    @staticmethod
+    def generate_bulk_otp(phones, order):
+        # one store write and batched sms for many phones (admin campaigns)
+        # returns {phone: error message or None}
+        phones = list(dict.fromkeys(phones))
+        if settings.SMS_OUTBOX:
+            with transaction.atomic():
+                codes = get_otp_store().issue_many(phones, order)
+                SMSOutbox.objects.bulk_create(
+                    [SMSOutbox(phone=phone, template=order, token=code, bulk=True) for phone, code in codes.items()],
+                    batch_size=1000,
+                )
+            return dict.fromkeys(codes)
+
+        codes = get_otp_store().issue_many(phones, order)
+        return OTPService.send_sms_batch(list(codes.items()), order)
+
+    @staticmethod
+    def send_sms_batch(messages, order):
+        # [(phone, code)] of distinct phones -> {phone: error message or None}
+        results = get_sms_gateway().send_otp_batch(messages, order)
+        return {phone: str(result) if isinstance(result, SMSError) else None for phone, result in results.items()}
+
     @staticmethod
     def send_sms(phone_number, code, order):
         try:
-            api = KavenegarAPI(settings.KAVENEGAR_API_KEY)
-            params = {
-                'receptor': phone_number,
-                'template': order,
-                'token': code,
-                'type': 'sms', #sms vs call
-            }
-            response = api.verify_lookup(params)
-            # print(f'###{response}###')
-            return response
-        except APIException as e:
-            decoded_error = e.args[0].decode('utf-8')
-            raise ValidationError(f"Error sending SMS: {decoded_error}")
-        except HTTPException as e:
-            raise ValidationError(f"Error connecting to KAVENEGAR service: {str(e)}")
+            return get_sms_gateway().send_otp(phone_number, code, order)
+        except SMSError as e:
+            raise ValidationError(str(e))
 
 
     @staticmethod
-    def verify_otp(phone, code):
-        otp = OTPCode.objects.filter(
-            phone=phone,
-            code=code,
-            is_used=False,
-            expires_at__gte=timezone.now()
-        ).first()
-        
-        if otp:
-            otp.is_used = True
-            otp.save()
-            return True
-        return False
+    def consume_otp(phone, code):
+        if not get_otp_store().consume(phone, code):
+            return False
+        # the code is used, the next request of this phone needs a new one
+        caches[settings.OTP_CACHE_ALIAS].delete(OTPService.otp_flight_key(phone))
+        return True
     
 
+    @staticmethod
+    def verify_otp(phone, code):
+        # consume the code, flag the user verified and mint tokens in one transaction
+        # returns (user or None, refresh token or None when the code is wrong)
+        with transaction.atomic():
+            user = User.objects.filter(phone=phone).first()
+            if user is None or not OTPService.consume_otp(phone, code):
+                return user, None
+            if not user.is_verified:
+                # single-column conditional update instead of save() of every field
+                User.objects.filter(pk=user.pk, is_verified=False).update(is_verified=True)
+                invalidate_cached_user(user.pk) # update() sends no signal
+                user.is_verified = True
+            # writes an OutstandingToken row in the same transaction if the blacklist app is installed
+            return user, RevocableRefreshToken.for_user(user)
+
     @staticmethod
     def check_throttle(ip_address, phone=None, attempt_type='LOGIN'):
         # check faild-attempts-number
-        one_hour_ago = timezone.now() - timedelta(hours=settings.ATTEMPTS_TIME_RANGE)
-
-        if phone:
-            phone_attempts = FailedAttempt.objects.filter(attempt_type=attempt_type,\
-                                                          created_at__gte=one_hour_ago,\
-                                                          phone=phone).count()
-            if phone_attempts > settings.FAILED_ATTEMPTS_LIMIT:
-                return False
-            
-        ip_attempts = FailedAttempt.objects.filter(
-            ip_address=ip_address,
-            attempt_type=attempt_type,
-            created_at__gte=one_hour_ago
-        ).count()
-        if ip_attempts > settings.FAILED_ATTEMPTS_LIMIT:
-            # AuthService.block_ip(ip, 'LOGIN')
-            return False
-        
-        return True
+        return get_attempt_limiter().is_allowed(ip_address, phone, attempt_type)
     
     @staticmethod
     def record_failed_attempt(ip_address, phone=None, attempt_type='LOGIN'):
-        FailedAttempt.objects.create(
-            ip_address=ip_address,
-            phone=phone,
-            attempt_type=attempt_type
-        )
+        get_attempt_limiter().record(ip_address, phone, attempt_type)
+
+    # async versions for the async views (ASGI)
+    @staticmethod
+    async def aauthenticate(phone, password):
+        user = await User.objects.filter(phone=phone).afirst()
+        # hashing is cpu work, keep it off the event loop
+        is_correct, must_update = await sync_to_async(
+            OTPService.verify_password, thread_sensitive=False)(user, password)
+        if must_update:
+            await sync_to_async(user.set_password, thread_sensitive=False)(password)
+            await user.asave(update_fields=['password'])
+        return (user if is_correct else None), user is not None
+
+    @staticmethod
+    async def agenerate_otp(phone, order):
+        cache = caches[settings.OTP_CACHE_ALIAS]
+        key = OTPService.otp_flight_key(phone)
+        if settings.OTP_RESEND_COOLDOWN and not await cache.aadd(key, 'issuing', timeout=settings.OTP_RESEND_COOLDOWN):
+            state = await cache.aget(key)
+            if state == 'issuing' or (state == 'issued' and await get_otp_store().ahas_code(phone)):
+                return None
+            await cache.adelete(key)
+            if not await cache.aadd(key, 'issuing', timeout=settings.OTP_RESEND_COOLDOWN):
+                return None
+        try:
+            code = await OTPService.aissue_otp(phone, order)
+        except Exception:
+            await cache.adelete(key)
+            raise
+        if settings.OTP_RESEND_COOLDOWN:
+            await cache.aset(key, 'issued', timeout=settings.OTP_RESEND_COOLDOWN)
+        return code
+
+    @staticmethod
+    async def aissue_otp(phone, order):
+        if settings.SMS_OUTBOX:
+            # the outbox row is written in the otp transaction, that needs the sync version
+            return await sync_to_async(OTPService.issue_otp)(phone, order)
+        code = await get_otp_store().aissue(phone, order)
+        await OTPService.asend_sms(phone, code, order)
+        return code
+
+    @staticmethod
+    async def asend_sms(phone_number, code, order):
+        try:
+            return await get_sms_gateway().asend_otp(phone_number, code, order)
+        except SMSError as e:
+            raise ValidationError(str(e))
+
+    @staticmethod
+    async def aconsume_otp(phone, code):
+        if not await get_otp_store().aconsume(phone, code):
+            return False
+        await caches[settings.OTP_CACHE_ALIAS].adelete(OTPService.otp_flight_key(phone))
+        return True
+
+    @staticmethod
+    async def averify_otp(phone, code):
+        # transaction.atomic is sync only
+        return await sync_to_async(OTPService.verify_otp)(phone, code)
+
+    @staticmethod
+    async def acheck_throttle(ip_address, phone=None, attempt_type='LOGIN'):
+        return await get_attempt_limiter().ais_allowed(ip_address, phone, attempt_type)
+
+    @staticmethod
+    async def arecord_failed_attempt(ip_address, phone=None, attempt_type='LOGIN'):
+        await get_attempt_limiter().arecord(ip_address, phone, attempt_type)
 
     # @staticmethod
     # def block_ip(ip, block_type):
@@ -0,0 +1,482 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
+from contextlib import contextmanager
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+from kavenegar import KavenegarAPI, APIException, HTTPException
+
+
+
+class PooledKavenegarAPI(KavenegarAPI):
+    # KavenegarAPI sends every call with requests.post (new connection + tls handshake each time).
+    # this one keeps a keep-alive connection pool in a single requests.Session and uses timeouts
+
+    def __init__(self, apikey, base_url='https://api.kavenegar.com', pool_size=10, timeout=(3, 10)):
+        super().__init__(apikey)
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _request(self, action, method, params={}):
+        url = f'{self.base_url}/{self.version}/{self.apikey}/{action}/{method}.json'
+        try:
+            content = self.session.post(url, data=params, timeout=self.timeout).content
+        except requests.exceptions.RequestException as e:
+            raise HTTPException(e)
+        return parse_response(content)
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncKavenegarAPI:
+    # same api for the async views, on a pooled httpx.AsyncClient
+
+    def __init__(self, apikey, base_url='https://api.kavenegar.com', pool_size=10, timeout=(3, 10)):
+        self.url = f"{base_url.rstrip('/')}/v1/{apikey}"
+        self.client = httpx.AsyncClient(
+            headers=KavenegarAPI(apikey).headers,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+        )
+
+    async def _request(self, action, method, params=None):
+        try:
+            response = await self.client.post(f'{self.url}/{action}/{method}.json', data=params)
+        except httpx.HTTPError as e:
+            raise HTTPException(e)
+        return parse_response(response.content)
+
+    async def verify_lookup(self, params=None):
+        return await self._request('verify', 'lookup', params)
+
+
+def parse_response(content):
+    try:
+        response = json.loads(content.decode('utf-8'))
+    except ValueError as e:
+        raise HTTPException(e)
+    if response['return']['status'] != 200:
+        raise APIException(('APIException[%s] %s' % (response['return']['status'],
+                                                      response['return']['message'])).encode('utf-8'))
+    return response['entries']
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_sms_client():
+    # one client (and connection pool) per process
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PooledKavenegarAPI(
+                    settings.KAVENEGAR_API_KEY,
+                    base_url=settings.KAVENEGAR_BASE_URL,
+                    pool_size=settings.KAVENEGAR_POOL_SIZE,
+                    timeout=(settings.KAVENEGAR_CONNECT_TIMEOUT, settings.KAVENEGAR_READ_TIMEOUT),
+                )
+    return _client
+
+
+# httpx clients are bound to the event loop they were first used on
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_sms_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncKavenegarAPI(
+            settings.KAVENEGAR_API_KEY,
+            base_url=settings.KAVENEGAR_BASE_URL,
+            pool_size=settings.KAVENEGAR_POOL_SIZE,
+            timeout=(settings.KAVENEGAR_CONNECT_TIMEOUT, settings.KAVENEGAR_READ_TIMEOUT),
+        )
+    return client
+
+
+def reset_sms_client():
+    # sockets must not be shared between processes, a forked worker (gunicorn) builds its own pool
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+    _async_clients.clear()
+
+
+class SMSError(Exception):
+    # the provider rejected the message (bad receptor, template, ...)
+    pass
+
+
+class SMSProviderError(SMSError):
+    # the provider is unavailable (connection error, timeout, open circuit); try another one
+    pass
+
+
+class BaseSMSProvider:
+    name = None
+
+    def send_otp(self, phone, code, template):
+        raise NotImplementedError
+
+    async def asend_otp(self, phone, code, template):
+        # network only (no db), so it doesn't have to run in the main sync thread
+        return await sync_to_async(self.send_otp, thread_sensitive=False)(phone, code, template)
+
+    def send_otp_batch(self, messages, template):
+        # [(phone, code)] -> {phone: provider entry or SMSError}. one call per message here,
+        # providers with a batch api override it. raises SMSProviderError only when nothing
+        # was sent, after that the unsent phones get the error (the gateway fails them over)
+        results = {}
+        for i, (phone, code) in enumerate(messages):
+            try:
+                results[phone] = self.send_otp(phone, code, template)
+            except SMSProviderError as e:
+                if not results:
+                    raise
+                results.update((unsent, e) for unsent, _ in messages[i:])
+                break
+            except SMSError as e:
+                results[phone] = e
+        return results
+
+
+class KavenegarProvider(BaseSMSProvider):
+    name = 'kavenegar'
+    # sms/sendarray delivery statuses of rejected messages
+    failed_statuses = {6, 11, 13, 14, 100}
+
+    @staticmethod
+    def get_params(phone, code, template):
+        return {
+            'receptor': phone,
+            'template': template,
+            'token': code,
+            'type': 'sms', #sms vs call
+        }
+
+    @contextmanager
+    def translate_errors(self):
+        try:
+            yield
+        except APIException as e:
+            decoded_error = e.args[0].decode('utf-8')
+            raise SMSError(f"Error sending SMS: {decoded_error}")
+        except HTTPException as e:
+            raise SMSProviderError(f"Error connecting to KAVENEGAR service: {str(e)}")
+
+    def send_otp(self, phone, code, template):
+        with self.translate_errors():
+            return get_sms_client().verify_lookup(self.get_params(phone, code, template))
+
+    async def asend_otp(self, phone, code, template):
+        with self.translate_errors():
+            return await get_async_sms_client().verify_lookup(self.get_params(phone, code, template))
+
+    def send_otp_batch(self, messages, template):
+        # verify/lookup takes one receptor. sms/sendarray sends KAVENEGAR_BATCH_SIZE plain
+        # messages (KAVENEGAR_BULK_MESSAGES[template]) from KAVENEGAR_SENDER in one call.
+        # without a sender line: one verify/lookup per message (the bulk endpoint refuses to run)
+        if not settings.KAVENEGAR_SENDER:
+            return super().send_otp_batch(messages, template)
+        text = settings.KAVENEGAR_BULK_MESSAGES[template]
+        results = {}
+        for start in range(0, len(messages), settings.KAVENEGAR_BATCH_SIZE):
+            chunk = messages[start:start + settings.KAVENEGAR_BATCH_SIZE]
+            try:
+                with self.translate_errors():
+                    entries = get_sms_client().sms_sendarray({
+                        'receptor': json.dumps([phone for phone, _ in chunk]),
+                        'sender': json.dumps([settings.KAVENEGAR_SENDER] * len(chunk)),
+                        'message': json.dumps([text.format(code=code) for _, code in chunk]),
+                    })
+            except SMSProviderError as e:
+                if not results:
+                    raise
+                results.update((phone, e) for phone, _ in messages[start:])
+                break
+            except SMSError as e:
+                results.update((phone, e) for phone, _ in chunk)
+                continue
+            # entries are in receptor order
+            for (phone, _), entry in zip(chunk, entries):
+                if entry.get('status') in self.failed_statuses:
+                    results[phone] = SMSError(f"Error sending SMS: {entry.get('statustext')}")
+                else:
+                    results[phone] = entry
+        return results
+
+
+class FakeSMSProvider(BaseSMSProvider):
+    # in-process provider for tests and offline benchmarks, keeps the sent messages in memory
+
+    def __init__(self, name='fake', latency=0, failure_rate=0):
+        self.name = name
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = []
+
+    def send_otp(self, phone, code, template):
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise SMSProviderError(f'{self.name} is unavailable')
+        self.sent.append((phone, code, template))
+        return [{'receptor': phone, 'status': 1}]
+
+    async def asend_otp(self, phone, code, template):
+        await asyncio.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise SMSProviderError(f'{self.name} is unavailable')
+        self.sent.append((phone, code, template))
+        return [{'receptor': phone, 'status': 1}]
+
+    def send_otp_batch(self, messages, template):
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise SMSProviderError(f'{self.name} is unavailable')
+        self.sent.extend((phone, code, template) for phone, code in messages)
+        return {phone: {'receptor': phone, 'status': 1} for phone, _ in messages}
+
+
+class CircuitBreaker:
+    # closed: requests pass. open (after `failure_threshold` consecutive failures): requests fail fast.
+    # half-open (`reset_timeout` seconds later): one trial request decides between closed and open
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def available(self):
+        # like allow() without taking the half-open trial
+        with self.lock:
+            return self.opened_at is None or \
+                (not self.trial_running and time.monotonic() - self.opened_at >= self.reset_timeout)
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_running or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class SMSGateway:
+    # sends through the fastest available provider (ewma of latency, configured order until
+    # measured), skips providers whose circuit is open and fails over on SMSProviderError.
+    # with `hedge_delay` the next provider is also tried when the first hasn't answered in time
+    ewma_alpha = 0.2
+
+    def __init__(self, providers, hedge_delay=None, failure_threshold=5, reset_timeout=30):
+        self.providers = providers
+        self.hedge_delay = hedge_delay
+        self.breakers = {p.name: CircuitBreaker(failure_threshold, reset_timeout) for p in providers}
+        self.latency = {}
+        self.executor = None
+
+    def route(self):
+        order = {p.name: i for i, p in enumerate(self.providers)}
+        return sorted(
+            [p for p in self.providers if self.breakers[p.name].available()],
+            key=lambda p: (self.latency.get(p.name, float('inf')), order[p.name])
+        )
+
+    @contextmanager
+    def track(self, provider, measure=True):
+        # feeds the provider's circuit breaker and latency average (single sends only)
+        breaker = self.breakers[provider.name]
+        if not breaker.allow():
+            raise SMSProviderError(f'{provider.name} is temporarily unavailable')
+        start = time.monotonic()
+        try:
+            yield
+        except SMSProviderError:
+            breaker.record_failure()
+            raise
+        except SMSError:
+            # the provider answered, it is healthy
+            breaker.record_success()
+            raise
+        except Exception:
+            # unknown provider bug, don't leave a half-open breaker stuck
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        if not measure:
+            return
+        elapsed = time.monotonic() - start
+        previous = self.latency.get(provider.name)
+        self.latency[provider.name] = elapsed if previous is None else \
+            self.ewma_alpha * elapsed + (1 - self.ewma_alpha) * previous
+
+    def call(self, provider, phone, code, template):
+        with self.track(provider):
+            return provider.send_otp(phone, code, template)
+
+    async def acall(self, provider, phone, code, template):
+        with self.track(provider):
+            return await provider.asend_otp(phone, code, template)
+
+    def send_otp(self, phone, code, template):
+        candidates = self.route()
+        if not candidates:
+            raise SMSProviderError('SMS service is temporarily unavailable')
+        if self.hedge_delay is not None and len(candidates) > 1:
+            return self.send_hedged(candidates, phone, code, template)
+
+        error = None
+        for provider in candidates:
+            try:
+                return self.call(provider, phone, code, template)
+            except SMSProviderError as e:
+                error = e
+        raise error
+
+    def send_hedged(self, candidates, phone, code, template):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=4 * len(self.providers))
+        futures = [self.executor.submit(self.call, candidates[0], phone, code, template)]
+        done, _ = wait(futures, timeout=self.hedge_delay)
+        if not done or isinstance(futures[0].exception(), SMSProviderError):
+            futures.append(self.executor.submit(self.call, candidates[1], phone, code, template))
+
+        error = None
+        for future in as_completed(futures):
+            try:
+                return future.result()
+            except SMSProviderError as e:
+                error = e
+        # both hedged providers failed, fall back to the rest in order
+        for provider in candidates[2:]:
+            try:
+                return self.call(provider, phone, code, template)
+            except SMSProviderError as e:
+                error = e
+        raise error
+
+    def send_otp_batch(self, messages, template):
+        # {phone: provider entry or SMSError}. the batch goes to the fastest provider, phones it
+        # couldn't reach fail over to the next ones. no hedging, a batch must not go out twice
+        results = {}
+        pending = list(messages)
+        error = SMSProviderError('SMS service is temporarily unavailable')
+        for provider in self.route():
+            try:
+                with self.track(provider, measure=False):
+                    sent = provider.send_otp_batch(pending, template)
+            except SMSProviderError as e:
+                error = e
+                continue
+            results.update(sent)
+            pending = [(phone, code) for phone, code in pending if isinstance(sent[phone], SMSProviderError)]
+            if not pending:
+                break
+        for phone, _ in pending:
+            results.setdefault(phone, error)
+        return results
+
+    async def asend_otp(self, phone, code, template):
+        candidates = self.route()
+        if not candidates:
+            raise SMSProviderError('SMS service is temporarily unavailable')
+        if self.hedge_delay is not None and len(candidates) > 1:
+            return await self.asend_hedged(candidates, phone, code, template)
+
+        error = None
+        for provider in candidates:
+            try:
+                return await self.acall(provider, phone, code, template)
+            except SMSProviderError as e:
+                error = e
+        raise error
+
+    async def asend_hedged(self, candidates, phone, code, template):
+        tasks = [asyncio.ensure_future(self.acall(candidates[0], phone, code, template))]
+        done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+        if not done or isinstance(tasks[0].exception(), SMSProviderError):
+            tasks.append(asyncio.ensure_future(self.acall(candidates[1], phone, code, template)))
+
+        error = None
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                return await next_done
+            except SMSProviderError as e:
+                error = e
+        for provider in candidates[2:]:
+            try:
+                return await self.acall(provider, phone, code, template)
+            except SMSProviderError as e:
+                error = e
+        raise error
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def bulk_sms_configured():
+    # sms/sendarray needs a sender line
+    return settings.KAVENEGAR_SENDER or not any(
+        isinstance(provider, KavenegarProvider) for provider in get_sms_gateway().providers)
+
+
+def get_sms_gateway():
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                providers = [import_string(p['BACKEND'])(**p.get('OPTIONS', {}))
+                             for p in settings.SMS_PROVIDERS]
+                _gateway = SMSGateway(
+                    providers,
+                    hedge_delay=settings.SMS_HEDGE_DELAY,
+                    failure_threshold=settings.SMS_BREAKER_FAILURE_THRESHOLD,
+                    reset_timeout=settings.SMS_BREAKER_RESET_TIMEOUT,
+                )
+    return _gateway
+
+
+def reset_sms_gateway():
+    # executor threads and locks don't survive fork
+    global _gateway, _gateway_lock
+    _gateway = None
+    _gateway_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_sms_client)
+os.register_at_fork(after_in_child=reset_sms_gateway)
@@ -1,3 +1,440 @@
-from django.test import TestCase
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipIf
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.views import TokenRefreshView
+from .authentication import CachedJWTAuthentication, invalidate_cached_user
+from .limiters import (BufferedAttemptLimiter, CacheAttemptLimiter, DatabaseAttemptLimiter, RollupAttemptLimiter,
+                       get_attempt_limiter)
+from .models import FailedAttempt, OTPCode, User
+from .otp_stores import get_otp_store
+from .revocation import RevocableRefreshToken, reset_revocation_list
+from .services import OTPService
+from .sms import (BaseSMSProvider, CircuitBreaker, FakeSMSProvider, SMSError, SMSGateway, SMSProviderError,
+                  reset_sms_gateway)
+from .views import LoginAPIView
 
-# Create your tests here.
+PHONE = '09120000001'
+
+
+class ConsumeOTPConcurrencyTests(TransactionTestCase):
+    # parallel verifies of one code: exactly one of them may use it
+    threads = 10
+
+    def setUp(self):
+        cache.clear()
+        get_otp_store.cache_clear()
+        self.addCleanup(get_otp_store.cache_clear)
+
+    def consume_concurrently(self, code):
+        barrier = threading.Barrier(self.threads)
+
+        def consume():
+            barrier.wait()
+            try:
+                return OTPService.consume_otp(PHONE, code)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            futures = [executor.submit(consume) for _ in range(self.threads)]
+        return [future.result() for future in futures]
+
+    # sqlite's shared in-memory test db fails concurrent writers with 'table is locked'
+    @skipIf(connection.vendor == 'sqlite', 'needs a db with concurrent writers')
+    @override_settings(OTP_STORE='auth_app.otp_stores.DatabaseOTPStore')
+    def test_database_store(self):
+        code = get_otp_store().issue(PHONE, 'auth-login')
+        results = self.consume_concurrently(code)
+        self.assertEqual(results.count(True), 1)
+        self.assertTrue(OTPCode.objects.get(phone=PHONE).is_used)
+
+    @override_settings(OTP_STORE='auth_app.otp_stores.CacheOTPStore')
+    def test_cache_store(self):
+        code = get_otp_store().issue(PHONE, 'auth-login')
+        results = self.consume_concurrently(code)
+        self.assertEqual(results.count(True), 1)
+
+    @override_settings(OTP_STORE='auth_app.otp_stores.DatabaseOTPStore')
+    def test_expired_code(self):
+        code = get_otp_store().issue(PHONE, 'auth-login')
+        # save() always sets a fresh expires_at
+        OTPCode.objects.filter(phone=PHONE).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.consume_concurrently(code).count(True), 0)
+
+
+@override_settings(
+    OTP_STORE='auth_app.otp_stores.DatabaseOTPStore',
+    FAILED_ATTEMPTS_LIMITER='auth_app.limiters.DatabaseAttemptLimiter',
+    SMS_PROVIDERS=[{'BACKEND': 'auth_app.sms.FakeSMSProvider'}],
+    SMS_OUTBOX=0,
+    OTP_RESEND_COOLDOWN=0,
+    PASSWORD_HASH_ITERATIONS=1000,
+)
+class LoginQueryCountTests(TestCase):
+    # one User SELECT per login, whatever the outcome. the rest is fixed by the db limiter
+    # (2 COUNTs, + 1 INSERT on failure) and the db store (DELETE + INSERT on success)
+
+    def setUp(self):
+        cache.clear()
+        for reset in (get_otp_store.cache_clear, get_attempt_limiter.cache_clear, reset_sms_gateway):
+            reset()
+            self.addCleanup(reset)
+        User.objects.create_user(phone=PHONE, password='right-password')
+
+    def login(self, phone, password, num_queries):
+        request = APIRequestFactory().post('/login/', {'phone': phone, 'password': password}, format='json')
+        with self.assertNumQueries(num_queries), CaptureQueriesContext(connection) as queries:
+            response = LoginAPIView.as_view()(request)
+        user_selects = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and 'auth_app_user' in q['sql']]
+        self.assertEqual(len(user_selects), 1)
+        return response
+
+    def test_success(self):
+        self.assertEqual(self.login(PHONE, 'right-password', 5).status_code, 200)
+
+    def test_wrong_password(self):
+        self.assertEqual(self.login(PHONE, 'wrong-password', 4).status_code, 400)
+
+    def test_unknown_phone(self):
+        self.assertEqual(self.login('09120000002', 'right-password', 4).status_code, 400)
+
+
+class RefreshClaimsTests(TestCase):
+    # USER_CLAIMS follow the user on refresh, not the login
+
+    def setUp(self):
+        reset_revocation_list()
+        self.addCleanup(reset_revocation_list)
+        self.user = User.objects.create_user(phone=PHONE, password='password', is_staff=True)
+
+    def refresh(self, token):
+        request = APIRequestFactory().post('/jwt/refresh/', {'refresh': token}, format='json')
+        return TokenRefreshView.as_view()(request)
+
+    def test_demoted_user(self):
+        refresh = RevocableRefreshToken.for_user(self.user)
+        self.assertTrue(refresh['is_staff'])
+        User.objects.filter(pk=self.user.pk).update(is_staff=False)
+        response = self.refresh(str(refresh))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(AccessToken(response.data['access'])['is_staff'])
+        self.assertFalse(RevocableRefreshToken(response.data['refresh'])['is_staff'])
+
+    def test_inactive_user(self):
+        refresh = RevocableRefreshToken.for_user(self.user)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.refresh(str(refresh)).status_code, 401)
+
+
+@override_settings(OTP_STORE='auth_app.otp_stores.HMACOTPStore')
+class HMACOTPStoreTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        get_otp_store.cache_clear()
+        self.addCleanup(get_otp_store.cache_clear)
+        self.store = get_otp_store()
+
+    def test_single_use(self):
+        code = self.store.issue(PHONE, 'auth-login')
+        self.assertTrue(self.store.consume(PHONE, code))
+        self.assertFalse(self.store.consume(PHONE, code))
+
+    def test_counter_expired_before_consume(self):
+        self.assertTrue(self.store.consume(PHONE, self.store.issue(PHONE, 'auth-login')))
+        code = self.store.issue(PHONE, 'auth-login')
+        self.store.cache.delete(f'{self.store.key_prefix}:counter:{PHONE}')
+        self.assertTrue(self.store.consume(PHONE, code))
+
+
+@override_settings(
+    OTP_STORE='auth_app.otp_stores.CacheOTPStore',
+    SMS_PROVIDERS=[{'BACKEND': 'auth_app.sms.FakeSMSProvider'}],
+    SMS_OUTBOX=0,
+    OTP_RESEND_COOLDOWN=30,
+)
+class GenerateOTPFlightTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for reset in (get_otp_store.cache_clear, reset_sms_gateway):
+            reset()
+            self.addCleanup(reset)
+
+    def test_single_flight(self):
+        self.assertIsNotNone(OTPService.generate_otp(PHONE, 'auth-login'))
+        self.assertIsNone(OTPService.generate_otp(PHONE, 'auth-login'))
+
+    def test_stale_flight_taken_over(self):
+        code = OTPService.generate_otp(PHONE, 'auth-login')
+        # the code of the flight is gone, the flight key is still 'issued'
+        get_otp_store().consume(PHONE, code)
+        self.assertIsNotNone(OTPService.generate_otp(PHONE, 'auth-login'))
+        self.assertIsNone(OTPService.generate_otp(PHONE, 'auth-login'))
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class ImportUsersTests(TestCase):
+
+    def import_users(self, *lines, **options):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as f:
+            f.write('\n'.join(lines) + '\n')
+        self.addCleanup(os.remove, f.name)
+        stderr = StringIO()
+        call_command('import_users', f.name, method='bulk', workers=1, stdout=StringIO(), stderr=stderr, **options)
+        return stderr.getvalue()
+
+    def test_invalid_lines(self):
+        errors = self.import_users('{"phone": "09120000001"}', 'not json', '[1]', '{"phone": "123"}')
+        self.assertEqual(errors.count('record '), 3)
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_update_keeps_omitted_fields(self):
+        self.import_users('{"phone": "09120000001", "password": "pw", "first_name": "A"}')
+        self.import_users('{"phone": "09120000001", "last_name": "B"}', on_conflict='update')
+        user = User.objects.get(phone='09120000001')
+        self.assertEqual((user.first_name, user.last_name), ('A', 'B'))
+        self.assertTrue(user.check_password('pw'))
+
+
+class CachedJWTAuthenticationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(phone=PHONE, password='password')
+        self.token = AccessToken.for_user(self.user)
+
+    def test_cached_user(self):
+        authentication = CachedJWTAuthentication()
+        self.assertEqual(authentication.get_user(self.token), self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(authentication.get_user(self.token), self.user)
+
+    def test_invalidated_user(self):
+        authentication = CachedJWTAuthentication()
+        authentication.get_user(self.token)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        invalidate_cached_user(self.user.pk)
+        with self.assertRaises(AuthenticationFailed):
+            authentication.get_user(self.token)
+        User.objects.filter(pk=self.user.pk).delete()
+        invalidate_cached_user(self.user.pk)
+        with self.assertRaises(AuthenticationFailed):
+            authentication.get_user(self.token)
+
+
+class CircuitBreakerTests(TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+        self.assertFalse(self.breaker.available())
+
+    def test_half_open_trial(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        time.sleep(0.06)
+        self.assertTrue(self.breaker.available())
+        # one trial request, the others keep failing fast until it ends
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_reopens(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        time.sleep(0.06)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+
+
+class FlakySMSProvider(FakeSMSProvider):
+    # unavailable after `capacity` messages, batches go one message per call
+    send_otp_batch = BaseSMSProvider.send_otp_batch
+
+    def __init__(self, name, capacity):
+        super().__init__(name)
+        self.capacity = capacity
+
+    def send_otp(self, phone, code, template):
+        if len(self.sent) >= self.capacity:
+            raise SMSProviderError(f'{self.name} is unavailable')
+        return super().send_otp(phone, code, template)
+
+
+class SMSGatewayTests(TestCase):
+
+    def test_failover(self):
+        down, up = FakeSMSProvider('down', failure_rate=1), FakeSMSProvider('up')
+        gateway = SMSGateway([down, up], failure_threshold=1)
+        gateway.send_otp(PHONE, '123456', 'verify')
+        self.assertEqual(len(up.sent), 1)
+        # the circuit of 'down' is open, the next sends skip it
+        self.assertEqual(gateway.route(), [up])
+        gateway.send_otp(PHONE, '123456', 'verify')
+        self.assertEqual(len(up.sent), 2)
+
+    def test_all_down(self):
+        gateway = SMSGateway([FakeSMSProvider('a', failure_rate=1), FakeSMSProvider('b', failure_rate=1)])
+        with self.assertRaises(SMSProviderError):
+            gateway.send_otp(PHONE, '123456', 'verify')
+
+    def test_rejected_message_no_failover(self):
+        rejecting, other = FakeSMSProvider('rejecting'), FakeSMSProvider('other')
+        rejecting.send_otp = mock.Mock(side_effect=SMSError('bad receptor'))
+        gateway = SMSGateway([rejecting, other])
+        with self.assertRaises(SMSError):
+            gateway.send_otp(PHONE, '123456', 'verify')
+        self.assertEqual(other.sent, [])
+
+    def test_async_failover(self):
+        down, up = FakeSMSProvider('down', failure_rate=1), FakeSMSProvider('up')
+        async_to_sync(SMSGateway([down, up]).asend_otp)(PHONE, '123456', 'verify')
+        self.assertEqual(len(up.sent), 1)
+
+    def test_hedging(self):
+        slow, fast = FakeSMSProvider('slow', latency=0.5), FakeSMSProvider('fast')
+        gateway = SMSGateway([slow, fast], hedge_delay=0.02)
+        start = time.monotonic()
+        result = gateway.send_otp(PHONE, '123456', 'verify')
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual(result, [{'receptor': PHONE, 'status': 1}])
+        self.assertEqual(len(fast.sent), 1)
+
+    def test_async_hedging(self):
+        slow, fast = FakeSMSProvider('slow', latency=0.5), FakeSMSProvider('fast')
+        gateway = SMSGateway([slow, fast], hedge_delay=0.02)
+        start = time.monotonic()
+        async_to_sync(gateway.asend_otp)(PHONE, '123456', 'verify')
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual(len(fast.sent), 1)
+
+    def test_batch_failover(self):
+        messages = [(f'0912000000{i}', f'00000{i}') for i in range(5)]
+        down, up = FakeSMSProvider('down', failure_rate=1), FakeSMSProvider('up')
+        results = SMSGateway([down, up]).send_otp_batch(messages, 'verify')
+        self.assertEqual(len(up.sent), 5)
+        self.assertFalse(any(isinstance(result, SMSError) for result in results.values()))
+
+    def test_batch_partial_failover(self):
+        # the phones the first provider couldn't reach go to the next one, the others aren't resent
+        messages = [(f'0912000000{i}', f'00000{i}') for i in range(5)]
+        flaky, up = FlakySMSProvider('flaky', capacity=2), FakeSMSProvider('up')
+        results = SMSGateway([flaky, up]).send_otp_batch(messages, 'verify')
+        self.assertEqual([phone for phone, _, _ in flaky.sent], [phone for phone, _ in messages[:2]])
+        self.assertEqual([phone for phone, _, _ in up.sent], [phone for phone, _ in messages[2:]])
+        self.assertEqual(len(results), 5)
+
+    def test_batch_all_down(self):
+        messages = [(PHONE, '123456')]
+        results = SMSGateway([FakeSMSProvider('a', failure_rate=1)]).send_otp_batch(messages, 'verify')
+        self.assertIsInstance(results[PHONE], SMSProviderError)
+
+
+class AttemptLimiterTestMixin:
+    # same behaviour for every FAILED_ATTEMPTS_LIMITER
+    limiter_class = None
+
+    def setUp(self):
+        settings = override_settings(FAILED_ATTEMPTS_LIMIT=3, ATTEMPTS_TIME_RANGE=1, FAILED_ATTEMPTS_AUDIT=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+        self.limiter = self.limiter_class()
+
+    def fail(self, times, ip_address='10.0.0.1', phone=PHONE):
+        for _ in range(times):
+            self.limiter.record(ip_address, phone, 'LOGIN')
+
+    def test_blocks_over_limit(self):
+        self.fail(3)
+        self.assertTrue(self.limiter.is_allowed('10.0.0.1', PHONE, 'LOGIN'))
+        self.fail(1)
+        self.assertFalse(self.limiter.is_allowed('10.0.0.1', PHONE, 'LOGIN'))
+
+    def test_counts_per_ip_phone_and_type(self):
+        self.fail(4)
+        # same phone from another ip, same ip for another phone
+        self.assertFalse(self.limiter.is_allowed('10.0.0.2', PHONE, 'LOGIN'))
+        self.assertFalse(self.limiter.is_allowed('10.0.0.1', '09120000002', 'LOGIN'))
+        self.assertTrue(self.limiter.is_allowed('10.0.0.2', '09120000002', 'LOGIN'))
+        self.assertTrue(self.limiter.is_allowed('10.0.0.1', PHONE, 'OTP'))
+
+    def test_async(self):
+        for _ in range(4):
+            async_to_sync(self.limiter.arecord)('10.0.0.1', PHONE, 'LOGIN')
+        self.assertFalse(async_to_sync(self.limiter.ais_allowed)('10.0.0.1', PHONE, 'LOGIN'))
+        self.assertTrue(async_to_sync(self.limiter.ais_allowed)('10.0.0.2', '09120000002', 'LOGIN'))
+
+
+class DatabaseAttemptLimiterTests(AttemptLimiterTestMixin, TestCase):
+    limiter_class = DatabaseAttemptLimiter
+
+    def test_window(self):
+        self.fail(4)
+        FailedAttempt.objects.update(created_at=timezone.now() - timedelta(hours=1, seconds=1))
+        self.assertTrue(self.limiter.is_allowed('10.0.0.1', PHONE, 'LOGIN'))
+
+
+class CacheAttemptLimiterTests(AttemptLimiterTestMixin, TestCase):
+    limiter_class = CacheAttemptLimiter
+
+
+class RollupAttemptLimiterTests(AttemptLimiterTestMixin, TestCase):
+    limiter_class = RollupAttemptLimiter
+
+
+@override_settings(FAILED_ATTEMPTS_FLUSH_SIZE=1000, FAILED_ATTEMPTS_MAX_BUFFER=5)
+class BufferedAttemptLimiterTests(AttemptLimiterTestMixin, TestCase):
+    limiter_class = BufferedAttemptLimiter
+
+    def setUp(self):
+        super().setUp()
+        # no flush thread, the tests flush (its connection would write outside the test transaction)
+        self.limiter.start = lambda: None
+        self.addCleanup(self.limiter.pending.clear)
+
+    def test_unflushed_attempts_count(self):
+        self.fail(4)
+        self.assertEqual(FailedAttempt.objects.count(), 0)
+        self.assertFalse(self.limiter.is_allowed('10.0.0.1', PHONE, 'LOGIN'))
+        self.limiter.flush()
+        self.assertEqual(FailedAttempt.objects.count(), 4)
+        self.assertEqual(len(self.limiter.pending), 0)
+        self.assertFalse(self.limiter.is_allowed('10.0.0.1', PHONE, 'LOGIN'))
+
+    def test_failed_flush_keeps_bounded_buffer(self):
+        self.fail(4)
+        with mock.patch.object(FailedAttempt.objects, 'bulk_create', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                self.limiter.flush()
+        self.assertEqual(len(self.limiter.pending), 4)
+        self.assertFalse(self.limiter.is_allowed('10.0.0.1', PHONE, 'LOGIN'))
+        # only the newest FAILED_ATTEMPTS_MAX_BUFFER are kept
+        self.fail(3)
+        self.assertEqual(len(self.limiter.pending), 5)
+        self.limiter.flush()
+        self.assertEqual(FailedAttempt.objects.count(), 5)
@@ -1,8 +1,14 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import SimpleRouter
 from rest_framework_simplejwt.views import TokenRefreshView, TokenVerifyView
-from .views import RegisterAPIView, LoginAPIView,get_csrf_token,\
-                    OTPVerificationView, UserCustomViewSet
+from .views import RegisterAPIView, LoginAPIView,get_csrf_token,jwks,\
+                    OTPVerificationView, UserCustomViewSet,\
+                    AsyncRegisterAPIView, AsyncLoginAPIView, AsyncOTPVerificationView
+
+if settings.ASYNC_VIEWS:
+    RegisterAPIView, LoginAPIView, OTPVerificationView = \
+        AsyncRegisterAPIView, AsyncLoginAPIView, AsyncOTPVerificationView
 
 
 
@@ -17,6 +23,7 @@ urlpatterns = [
     path('verify-otp/', OTPVerificationView.as_view(), name='verify-otp'),
     path('jwt/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('jwt/verify/', TokenVerifyView.as_view(), name='token_verify'),
+    path('jwt/jwks/', jwks, name='jwks'),
     path('get-csrf-token/', get_csrf_token, name='get-csrf-token'),
     # path('resend-otp/', ResendOTPAPIView.as_view(), name='resend-otp'),
 
@@ -1,13 +1,18 @@
+import csv
+import json
 from rest_framework import status,mixins,viewsets
 from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated,IsAdminUser
-from rest_framework_simplejwt.tokens import RefreshToken
+from adrf.views import APIView as AsyncAPIView
+from asgiref.sync import sync_to_async
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_protect , ensure_csrf_cookie
-from django.contrib.auth import authenticate
-from django.shortcuts import get_object_or_404
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag, require_GET
 from django.conf import settings
 from ipware import get_client_ip
 from drf_spectacular.utils import (
@@ -16,12 +21,15 @@ from drf_spectacular.utils import (
     OpenApiResponse,
     # OpenApiParameter
     )
-from .paginations import CustomPagination
+from .jwt_keys import get_jwks
+from .paginations import CustomPagination, UserCursorPagination
 from .services import OTPService
+from .sms import bulk_sms_configured
 from .serializers import (
     LoginSerializer,
     RegisterSerializer,
     VerifyOTPSerializer,
+    BulkOTPSerializer,
     UserSerializer,
     ChangePasswordSerializer
     )
@@ -32,6 +40,13 @@ from .models import User
 def get_csrf_token(request):
     return Response({'detail': 'CSRF cookie set'},status=status.HTTP_200_OK)
 
+@require_GET
+@cache_control(public=True, max_age=settings.JWKS_MAX_AGE)
+@etag(lambda request: get_jwks()[1])
+def jwks(request):
+    # public keys of the jwt signing keys, for services that verify tokens locally
+    return HttpResponse(get_jwks()[0], content_type='application/json')
+
 class RegisterAPIView(APIView):
     throttle_classes = [RegisterRateThrottle]
     @extend_schema(
@@ -171,7 +186,7 @@ class LoginAPIView(APIView):
         #         status=status.HTTP_429_TOO_MANY_REQUESTS
         #     )
         
-        user = authenticate(request, phone=phone, password=password)
+        user, exists = OTPService.authenticate(phone, password)
         
         if user is not None:
             order = 'auth-login'
@@ -184,7 +199,7 @@ class LoginAPIView(APIView):
                 status=status.HTTP_200_OK)
 
         else:
-            if not User.objects.filter(phone=phone).exists():
+            if not exists:
                 OTPService.record_failed_attempt(client_ip, attempt_type='LOGIN')
                 return Response(
                     {'error': 'User does not exist. Please register.'},
@@ -265,17 +280,11 @@ class OTPVerificationView(APIView):
                 status=status.HTTP_429_TOO_MANY_REQUESTS
             )
         
-        user = get_object_or_404(User,phone=phone)
-        if OTPService.verify_otp(phone, code):
-
-            # Authenticate User 
-            if not user.is_verified:
-                user.is_verified = True
-                user.save()
-
-            # Obtain Token
-            refresh = RefreshToken.for_user(user)
-        
+        # consume code, verify user and obtain token
+        user, refresh = OTPService.verify_otp(phone, code)
+        if user is None:
+            raise Http404
+        if refresh is not None:
             return Response({
                 'access': str(refresh.access_token),
                 'refresh': str(refresh),
@@ -291,6 +300,140 @@ class OTPVerificationView(APIView):
             )
 
 
+# native async versions of the auth endpoints, used instead of the sync ones when
+# settings.ASYNC_VIEWS is on (ASGI deployment with uvicorn workers)
+class AsyncRegisterAPIView(AsyncAPIView, RegisterAPIView):
+
+    async def post(self, request):
+        serializer = RegisterSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        await sync_to_async(serializer.save)()
+        phone = serializer.validated_data['phone']
+        client_ip, _ = get_client_ip(request)
+
+        if not await OTPService.acheck_throttle(client_ip, phone, attempt_type='LOGIN'):
+            return Response(
+                {'error': f'Too many attempts. Try again after {settings.ATTEMPTS_TIME_RANGE} hour.'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
+
+        order = 'auth-register'
+        await OTPService.agenerate_otp(phone, order)
+
+        return Response({
+            'message': 'User registered. OTP sent successfully',
+            'phone': phone
+        }, status=status.HTTP_201_CREATED)
+    post.kwargs = RegisterAPIView.post.kwargs # same api schema
+
+
+class AsyncLoginAPIView(AsyncAPIView, LoginAPIView):
+
+    async def post(self, request):
+        serializer = LoginSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        phone = serializer.validated_data['phone']
+        password = serializer.validated_data['password']
+        client_ip, _ = get_client_ip(request)
+
+        if not await OTPService.acheck_throttle(client_ip, phone, attempt_type='LOGIN'):
+            return Response(
+                {'error': f'Too many attempts. Try again after {settings.ATTEMPTS_TIME_RANGE} hour.'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
+
+        user, exists = await OTPService.aauthenticate(phone, password)
+
+        if user is not None:
+            order = 'auth-login'
+            await OTPService.agenerate_otp(phone, order)
+            return Response(
+                {'message': 'OTP sent to your phone'},
+                status=status.HTTP_200_OK)
+
+        if not exists:
+            await OTPService.arecord_failed_attempt(client_ip, attempt_type='LOGIN')
+            return Response(
+                {'error': 'User does not exist. Please register.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        await OTPService.arecord_failed_attempt(client_ip, phone, attempt_type='LOGIN')
+        return Response(
+            {'error': 'Invalid phone or password'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    post.kwargs = LoginAPIView.post.kwargs # same api schema
+
+
+class AsyncOTPVerificationView(AsyncAPIView, OTPVerificationView):
+
+    @method_decorator(csrf_protect)
+    async def post(self, request):
+        serializer = VerifyOTPSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        phone = serializer.validated_data['phone']
+        code = serializer.validated_data['code']
+        client_ip, _ = get_client_ip(request)
+
+        if not await OTPService.acheck_throttle(client_ip, phone, 'OTP'):
+            return Response(
+                {'error': f'Too many attempts. Try again after {settings.ATTEMPTS_TIME_RANGE} hour.'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
+
+        user, refresh = await OTPService.averify_otp(phone, code)
+        if user is None:
+            raise Http404
+        if refresh is not None:
+            return Response({
+                'access': str(refresh.access_token),
+                'refresh': str(refresh),
+                'user_id': user.id,
+                'phone': user.phone,
+                'is_verified': user.is_verified
+            })
+
+        await OTPService.arecord_failed_attempt(client_ip, phone, 'OTP')
+        return Response(
+            {'error': 'Invalid OTP code'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    post.kwargs = OTPVerificationView.post.kwargs # same api schema
+
+
+class Echo:
+    # file-like object for csv.writer that returns the line instead of buffering it
+    def write(self, value):
+        return value
+
+
+def export_csv(rows, fields):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([row[field] for field in fields])
+
+
+def export_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+# async versions for ASGI: StreamingHttpResponse would load a sync iterator whole with sync_to_async(list)
+async def aexport_csv(rows, fields):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    async for row in rows:
+        yield writer.writerow([row[field] for field in fields])
+
+
+async def aexport_ndjson(rows):
+    async for row in rows:
+        yield json.dumps(row) + '\n'
+
+
 class UserCustomViewSet(mixins.ListModelMixin,
                         mixins.RetrieveModelMixin,
                         mixins.DestroyModelMixin,
@@ -301,6 +444,14 @@ class UserCustomViewSet(mixins.ListModelMixin,
     serializer_class = UserSerializer
     pagination_class = CustomPagination
     permission_classes =[IsAdminUser]
+    export_chunk_size = 2000
+
+    @property
+    def paginator(self):
+        # ?pagination=cursor -> keyset pagination, no OFFSET for deep pages
+        if not hasattr(self, '_paginator') and self.request.query_params.get('pagination') == 'cursor':
+            self._paginator = UserCursorPagination()
+        return super().paginator
 
         # if create customer beside user    ################
         # elif self.action == 'create':
@@ -333,6 +484,51 @@ class UserCustomViewSet(mixins.ListModelMixin,
         serializer.save()
         return Response({'message': 'Password changed successfully'},status=status.HTTP_205_RESET_CONTENT)
 
+    @action(detail=False, methods=['post'], url_path='bulk-otp')
+    def bulk_otp(self, request):
+        # one otp to each registered phone of the list (re-verification campaigns), one store
+        # write and batched provider calls instead of a request per phone
+        if not bulk_sms_configured():
+            return Response({'error': 'Bulk sms is not configured (KAVENEGAR_SENDER).'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        serializer = BulkOTPSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        phones = serializer.validated_data['phones']
+        registered = set(User.objects.filter(phone__in=phones).values_list('phone', flat=True))
+        errors = OTPService.generate_bulk_otp([phone for phone in phones if phone in registered],
+                                              serializer.validated_data['order'])
+        sent_status = 'queued' if settings.SMS_OUTBOX else 'sent'
+        results = []
+        for phone in phones:
+            error = errors[phone] if phone in registered else 'User does not exist'
+            results.append({'phone': phone, 'status': 'failed' if error else sent_status, 'error': error})
+        return Response({
+            'sent': sum(result['error'] is None for result in results),
+            'failed': sum(result['error'] is not None for result in results),
+            'results': results,
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # all users streamed as ndjson (default) or csv: ?export_format=csv
+        # rows come from a server-side cursor as dicts, memory doesn't grow with the table
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in ('ndjson', 'csv'):
+            return Response({'error': 'export_format must be ndjson or csv'}, status=status.HTTP_400_BAD_REQUEST)
+        fields = UserSerializer.Meta.fields
+        queryset = User.objects.order_by('id').values(*fields)
+
+        if isinstance(request._request, ASGIRequest):
+            rows = queryset.aiterator(chunk_size=self.export_chunk_size)
+            content = aexport_csv(rows, fields) if export_format == 'csv' else aexport_ndjson(rows)
+        else:
+            rows = queryset.iterator(chunk_size=self.export_chunk_size)
+            content = export_csv(rows, fields) if export_format == 'csv' else export_ndjson(rows)
+        content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="users.{export_format}"'
+        return response
+
 
 
 
@@ -0,0 +1,99 @@
+"""
+Sync (gunicorn sync workers, WSGI) vs async (uvicorn workers, ASGI + ASYNC_VIEWS) login throughput.
+
+    python benchmarks/async_views.py [--workers 2] [--concurrency 50] [--requests 1000] [--sms-latency 0.1]
+
+Needs the database env vars of otp_auth/settings.py (DB_NAME, DB_HOST, ...).
+Every login authenticates and issues an OTP through a fake sms provider
+that takes --sms-latency seconds, see benchmarks/settings.py.
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILES = {
+    'sync': ['otp_auth.wsgi:application'],
+    'async': ['otp_auth.asgi:application', '-k', 'uvicorn_worker.UvicornWorker'],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+
+async def load(base_url, phone, password, concurrency, total):
+    latencies, statuses = [], {}
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await client.post('/register/', json={'phone': phone, 'password': password})
+
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                start = time.perf_counter()
+                response = await client.post('/login/', json={'phone': phone, 'password': password})
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return total / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--sms-latency', type=float, default=0.1)
+    args = parser.parse_args()
+
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'benchmarks.settings', 'PYTHONPATH': ROOT,
+           'BENCH_SMS_LATENCY': str(args.sms_latency)}
+    subprocess.run([sys.executable, 'manage.py', 'migrate', '--noinput', '-v0'], cwd=ROOT, env=env, check=True)
+
+    for name, app in PROFILES.items():
+        port = free_port()
+        server = subprocess.Popen(
+            ['gunicorn', *app, '--workers', str(args.workers), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+            cwd=ROOT, env={**env, 'ASYNC_VIEWS': '1' if name == 'async' else '0'})
+        try:
+            wait_for(port)
+            phone = f'09{random.randint(0, 10 ** 9 - 1):09d}'
+            rps, p50, p99, statuses = asyncio.run(
+                load(f'http://127.0.0.1:{port}', phone, 'bench-Passw0rd', args.concurrency, args.requests))
+            print(f'{name:5} workers={args.workers}  {rps:8.1f} req/s  p50 {p50 * 1000:7.1f} ms  '
+                  f'p99 {p99 * 1000:7.1f} ms  {statuses}')
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
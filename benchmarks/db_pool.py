@@ -0,0 +1,68 @@
+"""
+Connect-per-request vs the psycopg 3 connection pool.
+
+    python benchmarks/db_pool.py [--requests 2000] [--threads 4] [--queries 3]
+
+Needs the database env vars of otp_auth/settings.py (DB_NAME, DB_HOST, ...).
+A "request" runs --queries small queries and then closes the connection
+like Django does at the end of a request: without the pool that closes the
+socket, with the pool it hands the connection back.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+
+def configure(threads):
+    from django.conf import settings
+    default = settings.DATABASES['default']
+    settings.DATABASES['direct'] = {**default, 'OPTIONS': {}, 'CONN_MAX_AGE': 0}
+    settings.DATABASES['pooled'] = {**default, 'CONN_MAX_AGE': 0, 'OPTIONS': {'pool': {'min_size': threads, 'max_size': threads}}}
+
+
+def request(alias, queries):
+    from django.db import connections
+    connection = connections[alias]
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        for _ in range(queries):
+            cursor.execute('SELECT count(*) FROM auth_app_user WHERE phone = %s', ['09123456789'])
+            cursor.fetchone()
+    connection.close()
+    return time.perf_counter() - start
+
+
+def run(alias, total, threads, queries):
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: request(alias, queries), range(threads * 2)))  # warm up
+        start = time.perf_counter()
+        latencies = sorted(executor.map(lambda _: request(alias, queries), range(total)))
+        elapsed = time.perf_counter() - start
+    print(f'{alias:7} {total / elapsed:8.1f} req/s  p50 {latencies[len(latencies) // 2] * 1000:6.2f} ms  '
+          f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--queries', type=int, default=3)
+    args = parser.parse_args()
+
+    configure(args.threads)
+    import django
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+    for alias in ['direct', 'pooled']:
+        run(alias, args.requests, args.threads, args.queries)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+# settings for benchmarks/async_views.py: auth endpoints only, no rate limits or resend cooldown,
+# cheap password hashing and a fake sms provider with a fixed latency
+import os
+from otp_auth.settings import *  # noqa: F401,F403
+from otp_auth.settings import REST_FRAMEWORK
+
+ROOT_URLCONF = 'auth_app.urls'
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {scope: '1000000/hour' for scope in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']},
+}
+FAILED_ATTEMPTS_LIMIT = 10 ** 9
+OTP_RESEND_COOLDOWN = 0  # every request issues and sends a code
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+SMS_OUTBOX = 0
+SMS_PROVIDERS = [
+    {'BACKEND': 'auth_app.sms.FakeSMSProvider', 'OPTIONS': {'latency': float(os.getenv('BENCH_SMS_LATENCY', 0.1))}},
+]
@@ -0,0 +1,70 @@
+"""
+Per-call vs pooled Kavenegar client against a local stub http server.
+
+    python benchmarks/sms_client.py [--calls 500] [--latency 0.002]
+
+The stub answers like the kavenegar verify/lookup api after --latency seconds.
+There is no tls here, so the real gap (tcp + tls handshake per call) is bigger.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'otp_auth.settings')
+
+from auth_app.sms import PooledKavenegarAPI  # noqa: E402
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True
+    latency = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.latency)
+        body = json.dumps({'return': {'status': 200, 'message': 'ok'}, 'entries': [{'messageid': 1}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(name, calls, make_client):
+    params = {'receptor': '09123456789', 'template': 'auth-login', 'token': '123456', 'type': 'sms'}
+    start = time.perf_counter()
+    for _ in range(calls):
+        make_client().verify_lookup(params)
+    elapsed = time.perf_counter() - start
+    print(f'{name:10} {calls} calls  {elapsed:.3f}s  {elapsed / calls * 1000:.3f} ms/call')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    # old behaviour: a new client (and connection) for every sms
+    run('per-call', args.calls, lambda: PooledKavenegarAPI('key', base_url=base_url))
+    pooled = PooledKavenegarAPI('key', base_url=base_url)
+    run('pooled', args.calls, lambda: pooled)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Queries and latency of the OTP verify step: the previous view code vs OTPService.verify_otp.
+
+    python benchmarks/verify_otp.py [--rounds 500]
+
+Needs the database env vars of otp_auth/settings.py (DB_NAME, DB_HOST, ...).
+It runs in a throwaway test database (test_<DB_NAME>, created and dropped
+here), never in the app's database. Codes are kept in the OTPCode table
+(DatabaseOTPStore), which the previous code used. Each round issues a code
+for an unverified user and verifies it; throttle checks are left out since
+both versions run them the same way.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework_simplejwt.tokens import RefreshToken  # noqa: E402
+
+from auth_app.models import OTPCode, User  # noqa: E402
+from auth_app.otp_stores import get_otp_store  # noqa: E402
+from auth_app.services import OTPService  # noqa: E402
+
+
+def before(phone, code):
+    # the view and OTPService.verify_otp before the change: SELECT + full-row save() of the code
+    user = User.objects.get(phone=phone)
+    otp = OTPCode.objects.filter(phone=phone, code=code, is_used=False, expires_at__gte=timezone.now()).first()
+    if otp:
+        otp.is_used = True
+        otp.save()
+        if not user.is_verified:
+            user.is_verified = True
+            user.save()
+        return user, RefreshToken.for_user(user)
+    return user, None
+
+
+def after(phone, code):
+    return OTPService.verify_otp(phone, code)
+
+
+def run(name, verify, rounds):
+    users = User.objects.bulk_create([User(phone=f'0912{i:07d}') for i in range(rounds)])
+    codes = [get_otp_store().issue(user.phone, 'auth-login') for user in users]
+
+    latencies, queries = [], 0
+    for user, code in zip(users, codes):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            _, refresh = verify(user.phone, code)
+            latencies.append(time.perf_counter() - start)
+        assert refresh is not None
+        queries += len(captured.captured_queries)
+    User.objects.filter(pk__in=[user.pk for user in users]).delete()
+    OTPCode.objects.filter(phone__in=[user.phone for user in users]).delete()
+
+    latencies.sort()
+    print(f'{name:7} {queries / rounds:4.1f} queries/verify  p50 {latencies[len(latencies) // 2] * 1000:6.2f} ms  '
+          f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=500)
+    args = parser.parse_args()
+
+    settings.OTP_STORE = 'auth_app.otp_stores.DatabaseOTPStore'
+    get_otp_store.cache_clear()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        for name, verify in [('before', before), ('after', after)]:
+            run(name, verify, args.rounds)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
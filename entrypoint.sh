@@ -3,6 +3,7 @@
 # python manage.py flush --no-input
 python manage.py wait_for_db
 python manage.py migrate --noinput
+python manage.py partition_failed_attempts
 python manage.py collectstatic --noinput --clear
 
 exec "$@"
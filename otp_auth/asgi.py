@@ -14,3 +14,6 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'otp_auth.settings')
 
 application = get_asgi_application()
+
+from auth_app.hashers import warm_up  # noqa: E402
+warm_up()
@@ -50,7 +50,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'auth_app.authentication.CachedJWTAuthentication',
     ),
     # 'DEFAULT_THROTTLE_CLASSES': (
     #     'rest_framework.throttling.AnonRateThrottle',
@@ -73,13 +73,36 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    # rotated refresh tokens are revoked in RevokedToken (instead of the token_blacklist app)
+    'TOKEN_REFRESH_SERIALIZER': 'auth_app.serializers.RevocationTokenRefreshSerializer',
+    'TOKEN_VERIFY_SERIALIZER': 'auth_app.serializers.RevocationTokenVerifySerializer',
 }
-# CACHES = {
-#     "default": {
-#         "BACKEND": "django.core.cache.backends.redis.RedisCache",
-#         "LOCATION": "redis://127.0.0.1:6379",
-#     }
-# }
+# ES256 / EdDSA signing instead of HS256 with SECRET_KEY: space separated private key PEM files (P-256 or Ed25519).
+# the first key signs, all of them verify (kid header). rotation: add the new key second, wait JWKS_MAX_AGE,
+# move it first, drop the old one after REFRESH_TOKEN_LIFETIME
+JWT_PRIVATE_KEY_FILES = os.getenv('JWT_PRIVATE_KEY_FILES', default='').split()
+JWKS_MAX_AGE = 3600 # SECONDS, cache-control of /api/auth/jwt/jwks/
+# per-process bloom filter of revoked jtis (auth_app/revocation.py)
+TOKEN_REVOCATION_SYNC_INTERVAL = 2 # SECONDS, revocations of other workers are seen after at most this
+TOKEN_REVOCATION_SYNC_OVERLAP = 5 # SECONDS, re-read window for rows of late commits
+TOKEN_REVOCATION_REBUILD_INTERVAL = 300 # SECONDS, full rebuild drops expired jtis
+TOKEN_REVOCATION_BLOOM_CAPACITY = 100_000
+TOKEN_REVOCATION_BLOOM_ERROR_RATE = 0.001
+# shared cache (redis) in production, local-memory cache for tests/development
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -125,6 +148,34 @@ DATABASES = {
         'PORT': 5432,
     }
 }
+# psycopg 3 connection pool, one per worker process: workers * DB_POOL_MAX_SIZE must stay below
+# postgres max_connections, and MAX_SIZE should cover the threads of a process (gthread workers, dispatch_sms)
+DB_POOL = int(os.getenv('DB_POOL', default=1))
+if DB_POOL:
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', default=2)),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', default=10)),
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', default=10)), # SECONDS to wait for a free connection
+            'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', default=600)), # SECONDS before an idle connection above min_size is closed
+            'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', default=3600)), # SECONDS before a connection is replaced
+        },
+    }
+else:
+    # without the pool keep connections open between requests (not allowed together with the pool)
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', default=60)) # SECONDS
+# check a connection before it is handed out (by the pool) or reused (CONN_MAX_AGE)
+DATABASES['default']['CONN_HEALTH_CHECKS'] = bool(int(os.getenv('DB_HEALTH_CHECKS', default=1)))
+# read replicas (space separated hosts): reads of a request go to a replica, writes and
+# the reads after a write (read-your-writes, DB_PIN_SECONDS) to the primary. see auth_app/routers.py
+DB_REPLICAS = []
+for i, host in enumerate(os.getenv('DB_REPLICA_HOSTS', default='').split()):
+    DATABASES[f'replica_{i}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+    DB_REPLICAS.append(f'replica_{i}')
+DB_PIN_SECONDS = 5 # SECONDS
+if DB_REPLICAS:
+    DATABASE_ROUTERS = ['auth_app.routers.ReplicaRouter']
+    MIDDLEWARE.insert(1, 'auth_app.middleware.replica_pinning_middleware')
 
 # DATABASES = {
 #     'default': {
@@ -153,6 +204,22 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+PASSWORD_HASHERS = [
+    'auth_app.hashers.CalibratedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+# pbkdf2 cost: fixed iterations, or (if not set) calibrated per process to PASSWORD_HASH_TARGET_MS
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', default=0)) or None
+PASSWORD_HASH_TARGET_MS = 250
+PASSWORD_HASH_MIN_ITERATIONS = 1_000_000 # floor of the calibration (also never below django's PBKDF2PasswordHasher.iterations)
+PASSWORD_HASH_REHASH_TOLERANCE = 0.25 # rehash on login when stored iterations are more than 25% below the current ones
+# hashing thread pool per process, extra requests beyond MAX_QUEUE get 503
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', default=os.cpu_count() or 1))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv('PASSWORD_HASH_MAX_QUEUE', default=2 * PASSWORD_HASH_WORKERS))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -184,17 +251,78 @@ AUTH_USER_MODEL = 'auth_app.User'
 # SESSION_COOKIE_SECURE = True
 # CSRF_COOKIE_SECURE = True
 
+# native async register/login/verify-otp views, for the ASGI deployment (docker-compose.asgi.yml)
+ASYNC_VIEWS = int(os.getenv('ASYNC_VIEWS', default=0))
+
 # Rate limiting settings
 FAILED_ATTEMPTS_LIMIT = 3
 ATTEMPTS_TIME_RANGE = 1 # HOURS
+# failed attempts counter:
+#   auth_app.limiters.DatabaseAttemptLimiter -> FailedAttempt rows + COUNT queries
+#   auth_app.limiters.CacheAttemptLimiter    -> sliding window counters in CACHES[FAILED_ATTEMPTS_CACHE_ALIAS]
+#   auth_app.limiters.RollupAttemptLimiter   -> per-minute counters in FailedAttemptBucket (upsert increments)
+#   auth_app.limiters.BufferedAttemptLimiter -> FailedAttempt rows written behind in bulk_create batches, unflushed ones counted from memory
+FAILED_ATTEMPTS_LIMITER = os.getenv('FAILED_ATTEMPTS_LIMITER', 'auth_app.limiters.CacheAttemptLimiter' if REDIS_URL \
+                                    else 'auth_app.limiters.DatabaseAttemptLimiter')
+FAILED_ATTEMPTS_CACHE_ALIAS = 'default'
+FAILED_ATTEMPTS_FLUSH_SIZE = 500 # BufferedAttemptLimiter: buffered attempts that trigger a flush (and rows per INSERT)
+FAILED_ATTEMPTS_FLUSH_INTERVAL = 1 # SECONDS, BufferedAttemptLimiter: max time an attempt waits in the buffer
+FAILED_ATTEMPTS_MAX_BUFFER = 10 * FAILED_ATTEMPTS_FLUSH_SIZE # BufferedAttemptLimiter: unflushed attempts kept while the db is down (oldest dropped)
+FAILED_ATTEMPTS_BUCKETS = 60 # sub-buckets per ATTEMPTS_TIME_RANGE
+FAILED_ATTEMPTS_RETENTION_DAYS = 30 # FailedAttempt partitions older than this are dropped
+FAILED_ATTEMPTS_AUDIT = int(os.getenv('FAILED_ATTEMPTS_AUDIT', default=0)) # also keep FailedAttempt rows (non-db limiters)
 OTP_EXPIRE_MINUTES = 5
 
+# OTP storage backend:
+#   auth_app.otp_stores.CacheOTPStore    -> codes in CACHES[OTP_CACHE_ALIAS] with native TTL (needs a shared cache between workers)
+#   auth_app.otp_stores.DatabaseOTPStore -> codes in OTPCode table (durable/audit)
+#   auth_app.otp_stores.HMACOTPStore     -> codes derived from OTP_HMAC_SECRET and time step (issue marker and replay guard in cache)
+OTP_STORE = os.getenv('OTP_STORE', 'auth_app.otp_stores.CacheOTPStore' if REDIS_URL \
+                      else 'auth_app.otp_stores.DatabaseOTPStore')
+OTP_CACHE_ALIAS = 'default'
+# requests for a phone within this window (client retries, double submits) reuse the code already sent:
+# no new code, no second sms (cache.add in CACHES[OTP_CACHE_ALIAS], per process with locmem). 0: off
+OTP_RESEND_COOLDOWN = int(os.getenv('OTP_RESEND_COOLDOWN', default=30)) # SECONDS
+OTP_HMAC_SECRET = os.getenv('OTP_HMAC_SECRET', SECRET_KEY)
+OTP_TIME_STEP = 30 # SECONDS
+OTP_PURPOSES = ('auth-login', 'auth-register') # sms templates (order)
+
+# users of jwt requests are cached (dropped on user save/delete), use a locmem alias for a per-process cache
+JWT_USER_CACHE_ALIAS = 'default'
+JWT_USER_CACHE_TTL = 60 # SECONDS
+
 # NGINX 
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 USE_X_FORWARDED_HOST = True
 
 # KAVENEGAR SMS SERVICE
 KAVENEGAR_API_KEY = os.getenv('KAVENEGAR_API_KEY')
+KAVENEGAR_BASE_URL = os.getenv('KAVENEGAR_BASE_URL', 'https://api.kavenegar.com')
+KAVENEGAR_POOL_SIZE = int(os.getenv('KAVENEGAR_POOL_SIZE', default=10)) # keep-alive connections per process
+KAVENEGAR_CONNECT_TIMEOUT = 3 # SECONDS
+KAVENEGAR_READ_TIMEOUT = 10 # SECONDS
+# bulk otp (admin campaigns) goes through sms/sendarray: plain text from a dedicated line, not verify/lookup templates
+KAVENEGAR_SENDER = os.getenv('KAVENEGAR_SENDER') # required by users/bulk-otp (503 without it)
+KAVENEGAR_BULK_MESSAGES = {
+    'auth-login': 'Your login code: {code}',
+    'auth-register': 'Your verification code: {code}',
+}
+KAVENEGAR_BATCH_SIZE = 200 # receptors per sendarray call
+BULK_OTP_MAX_PHONES = int(os.getenv('BULK_OTP_MAX_PHONES', default=5000)) # phones per bulk otp request
+
+# sms providers in order of preference, {'BACKEND': ..., 'OPTIONS': {...}}
+# (auth_app.sms.FakeSMSProvider sends nothing, for tests/benchmarks)
+SMS_PROVIDERS = [
+    {'BACKEND': 'auth_app.sms.KavenegarProvider'},
+]
+SMS_HEDGE_DELAY = None # SECONDS, also send through the next provider if the first hasn't answered (None: off)
+SMS_BREAKER_FAILURE_THRESHOLD = 5 # consecutive failures before a provider is skipped
+SMS_BREAKER_RESET_TIMEOUT = 30 # SECONDS before an open provider is tried again
+# send OTP sms asynchronously through SMSOutbox + `manage.py dispatch_sms` worker
+SMS_OUTBOX = int(os.getenv('SMS_OUTBOX', default=0))
+SMS_OUTBOX_WORKERS = int(os.getenv('SMS_OUTBOX_WORKERS', default=4))
+SMS_OUTBOX_MAX_ATTEMPTS = 5
+SMS_OUTBOX_RETRY_DELAY = 2 # SECONDS, doubled after every failed attempt
 
 SPECTACULAR_SETTINGS = {
     'TITLE': 'your project API',
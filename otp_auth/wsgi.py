@@ -14,3 +14,6 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'otp_auth.settings')
 
 application = get_wsgi_application()
+
+from auth_app.hashers import warm_up  # noqa: E402
+warm_up()